@@ -0,0 +1,243 @@
+"""
+Golden corpus and performance regression check for the converter.
+
+    python benchmarks/regression.py -c fixtures -g golden.json -u     # record golden hashes and baseline
+    python benchmarks/regression.py -c fixtures -g golden.json        # compare against them
+
+Every .osu in the corpus directory, and every .osu inside each .osz, is converted in a fresh interpreter. The
+sha256 of each emitted file is compared with the golden file, and the conversion wall time and the peak memory
+(max RSS) of the process with the baseline. Exits with 1 if an output changed, a chart was added or removed,
+or time or memory grew by more than the thresholds.
+"""
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from argparse import ArgumentParser
+from argparse import SUPPRESS
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_memory_kb():
+    """
+    Returns the max RSS of this process in KiB, or None where the resource module is not available
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def convert_one(in_file, output_format):
+    """
+    Converts in_file without writing files and prints its result as JSON. Runs in the worker process.
+    """
+    sys.path.insert(0, REPO)
+    import om2bms.om_to_bms
+    from om2bms.report import convert_with_report
+
+    om2bms.om_to_bms.OsuManiaToBMSParser._convertion_options = {
+        "HITSOUND": True,
+        "BG": True,
+        "OFFSET": 0,
+        "JUDGE": 3,
+        "SPLIT": True,
+        "RESOLUTION": 960,
+        "WRITE_FILES": False
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        converted, record = convert_with_report(in_file, os.path.dirname(in_file), os.path.basename(in_file),
+                                                None, output_format)
+        wall_ms = (time.perf_counter() - start) * 1000
+    outputs = {}
+    if converted is not None:
+        for (path, data) in converted.output_data:
+            outputs[os.path.basename(path)] = hashlib.sha256(data).hexdigest()
+    print(json.dumps({
+        "status": record["status"],
+        "error": record["error"],
+        "outputs": outputs,
+        "wall_ms": round(wall_ms, 3),
+        "peak_kb": peak_memory_kb()
+    }))
+
+
+def corpus_charts(corpus, work_dir):
+    """
+    Returns [(key, path to .osu)] of every chart in corpus, sorted by key. Members of .osz files are extracted
+    into work_dir and keyed "set.osz/member.osu".
+    """
+    charts = []
+    for (root, _, files) in os.walk(corpus):
+        for name in files:
+            path = os.path.join(root, name)
+            key = os.path.relpath(path, corpus).replace(os.sep, "/")
+            if name.lower().endswith(".osu"):
+                charts.append((key, path))
+            elif name.lower().endswith(".osz"):
+                extract_dir = os.path.join(work_dir, str(len(charts)) + "_" + name)
+                with zipfile.ZipFile(path) as zipf:
+                    for member in zipf.namelist():
+                        if member.lower().endswith(".osu") and "/" not in member:
+                            zipf.extract(member, extract_dir)
+                            charts.append((key + "/" + member, os.path.join(extract_dir, member)))
+    return sorted(charts)
+
+
+def run_chart(path, output_format, runs, timeout):
+    """
+    Converts path runs times, each in a new interpreter. Returns the result with the lowest wall time and the
+    highest peak memory of all runs.
+    """
+    result = None
+    for _ in range(runs):
+        try:
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", path,
+                                      "-fmt", output_format], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     universal_newlines=True, timeout=timeout, check=False)
+        except subprocess.TimeoutExpired:
+            return {"status": "timeout", "error": None, "outputs": {}, "wall_ms": None, "peak_kb": None}
+        lines = process.stdout.strip().splitlines()
+        if process.returncode != 0 or len(lines) == 0:
+            return {"status": "crashed", "error": "exit code " + str(process.returncode), "outputs": {},
+                    "wall_ms": None, "peak_kb": None}
+        current = json.loads(lines[-1])
+        if result is None:
+            result = current
+        else:
+            result["wall_ms"] = min(result["wall_ms"], current["wall_ms"])
+            if current["peak_kb"] is not None:
+                result["peak_kb"] = max(result["peak_kb"], current["peak_kb"])
+    return result
+
+
+def compare(golden, current, args):
+    """
+    Returns the list of problems of current against its golden record
+    """
+    problems = []
+    if golden["status"] != current["status"]:
+        problems.append("status %s, was %s" % (current["status"], golden["status"]))
+    if golden["outputs"] != current["outputs"]:
+        for name in sorted(set(golden["outputs"]) | set(current["outputs"])):
+            if golden["outputs"].get(name) != current["outputs"].get(name):
+                problems.append("output changed: " + name)
+    if golden["wall_ms"] is not None and current["wall_ms"] is not None and \
+            current["wall_ms"] > golden["wall_ms"] * args.time_threshold and \
+            current["wall_ms"] - golden["wall_ms"] > args.min_ms:
+        problems.append("wall time %.1f ms, baseline %.1f ms" % (current["wall_ms"], golden["wall_ms"]))
+    if golden["peak_kb"] is not None and current["peak_kb"] is not None and \
+            current["peak_kb"] > golden["peak_kb"] * args.memory_threshold:
+        problems.append("peak memory %d KiB, baseline %d KiB" % (current["peak_kb"], golden["peak_kb"]))
+    return problems
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Golden output and performance regression check for om2bms")
+
+    parser.add_argument('--worker',
+                        default=None,
+                        help=SUPPRESS)
+
+    parser.add_argument('-c', '--corpus',
+                        default=None,
+                        help="Directory of .osu and .osz fixtures.")
+
+    parser.add_argument('-g', '--golden',
+                        default="golden.json",
+                        help="File of golden hashes and baseline times. Defaults to golden.json")
+
+    parser.add_argument('-u', '--update',
+                        action='store_true',
+                        default=False,
+                        help="Writes the current results to the golden file instead of comparing.")
+
+    parser.add_argument('-fmt', '--format',
+                        default='bms',
+                        choices=['bms', 'bmson'],
+                        help="Output format to convert to.")
+
+    parser.add_argument('-n', '--runs',
+                        default=3,
+                        type=int,
+                        help="Conversions per chart. The lowest wall time is kept. Defaults to 3.")
+
+    parser.add_argument('-tt', '--time_threshold',
+                        default=1.25,
+                        type=float,
+                        help="Fails if a chart takes longer than this times its baseline. Defaults to 1.25.")
+
+    parser.add_argument('-ms', '--min_ms',
+                        default=20,
+                        type=float,
+                        help="Time differences below this many ms are never a regression. Defaults to 20.")
+
+    parser.add_argument('-mt', '--memory_threshold',
+                        default=1.25,
+                        type=float,
+                        help="Fails if a chart needs more than this times its baseline peak memory. "
+                             "Defaults to 1.25.")
+
+    parser.add_argument('-to', '--timeout',
+                        default=120,
+                        type=float,
+                        help="Seconds before a conversion counts as hung. Defaults to 120.")
+
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        convert_one(args.worker, args.format)
+        exit(0)
+    if args.corpus is None:
+        parser.error("-c is required")
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = {}
+        for (key, path) in corpus_charts(args.corpus, work_dir):
+            results[key] = run_chart(path, args.format, args.runs, args.timeout)
+            print("%-60s %-8s %10s ms %10s KiB" % (key, results[key]["status"], results[key]["wall_ms"],
+                                                  results[key]["peak_kb"]))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.update:
+        with open(args.golden, "w", encoding="utf-8") as fp:
+            json.dump({"format": args.format, "python": platform.python_version(), "charts": results}, fp,
+                      indent=1, sort_keys=True, ensure_ascii=False)
+        print("Wrote %d charts to %s" % (len(results), args.golden))
+        exit(0)
+
+    with open(args.golden, "r", encoding="utf-8") as fp:
+        golden = json.load(fp)
+    if golden["format"] != args.format:
+        parser.error("%s was recorded with -fmt %s" % (args.golden, golden["format"]))
+    failures = 0
+    for key in sorted(set(golden["charts"]) | set(results)):
+        if key not in results:
+            problems = ["missing from the corpus"]
+        elif key not in golden["charts"]:
+            problems = ["not in the golden file, run with -u"]
+        else:
+            problems = compare(golden["charts"][key], results[key], args)
+        for problem in problems:
+            print("FAIL %s: %s" % (key, problem))
+        failures += len(problems) > 0
+    print("%d of %d charts failed" % (failures, len(set(golden["charts"]) | set(results))))
+    exit(1 if failures > 0 else 0)
@@ -0,0 +1,106 @@
+"""
+Measures import time and startup of the om2bms.py and om2bms_osz.py entry points.
+
+    python benchmarks/startup.py -osu chart.osu -osz set.osz -n 10
+
+Every run starts a fresh interpreter in a temporary directory. Without -osu/-osz only the argument parsing
+startup (-h) and the import of each entry point are timed.
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(command, runs):
+    """
+    Returns the wall times in ms of running command runs times, each in an empty working directory
+    """
+    times = []
+    for _ in range(runs):
+        cwd = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+            times.append((time.perf_counter() - start) * 1000)
+        finally:
+            shutil.rmtree(cwd)
+    return times
+
+
+def import_times(script):
+    """
+    Returns [(cumulative us, module)] of the top level imports of script from python -X importtime
+    """
+    code = "import runpy, sys; sys.argv = ['x']; sys.path.insert(0, %r); " \
+           "runpy.run_path(%r, run_name='benchmark')" % (REPO, script)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=False)
+    ret = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        # top level imports only
+        if name.startswith(" ") and not name.startswith("  "):
+            ret.append((int(fields[1]), name.strip()))
+    return sorted(ret, reverse=True)
+
+
+def report(name, times):
+    """
+    Prints min and median of times
+    """
+    print("%-40s min %8.1f ms   median %8.1f ms" % (name, min(times), statistics.median(times)))
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Startup benchmark for the om2bms command line tools")
+
+    parser.add_argument('-osu', '--osu',
+                        default=None,
+                        help="Also time converting this .osu file with om2bms.py.")
+
+    parser.add_argument('-osz', '--osz',
+                        default=None,
+                        help="Also time converting this .osz file with om2bms_osz.py.")
+
+    parser.add_argument('-n', '--runs',
+                        default=5,
+                        type=int,
+                        help="Runs per measurement. Defaults to 5.")
+
+    args = parser.parse_args()
+
+    om2bms_py = os.path.join(REPO, "om2bms.py")
+    om2bms_osz_py = os.path.join(REPO, "om2bms_osz.py")
+
+    report("python -c pass", time_command([sys.executable, "-c", "pass"], args.runs))
+    report("om2bms.py -h", time_command([sys.executable, om2bms_py, "-h"], args.runs))
+    report("om2bms_osz.py -h", time_command([sys.executable, om2bms_osz_py, "-h"], args.runs))
+    if args.osu is not None:
+        report("om2bms.py -i " + os.path.basename(args.osu),
+               time_command([sys.executable, om2bms_py, "-i", os.path.abspath(args.osu)], args.runs))
+    if args.osz is not None:
+        report("om2bms_osz.py -i " + os.path.basename(args.osz),
+               time_command([sys.executable, om2bms_osz_py, "-i", os.path.abspath(args.osz)], args.runs))
+        report("om2bms_osz.py -b -i " + os.path.basename(args.osz),
+               time_command([sys.executable, om2bms_osz_py, "-b", "-i", os.path.abspath(args.osz)], args.runs))
+
+    for script in (om2bms_py, om2bms_osz_py):
+        print()
+        print("Slowest imports of " + os.path.basename(script))
+        for (us, module) in import_times(script)[:8]:
+            print("%10.1f ms  %s" % (us / 1000, module))
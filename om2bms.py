@@ -1,8 +1,15 @@
+import io
 import os
+import sys
 
 from argparse import ArgumentParser
+from contextlib import redirect_stdout
 
 import om2bms.om_to_bms
+from om2bms.bms_reader import timing_error_report
+from om2bms.image_resizer import IMAGE_SIZES
+from om2bms.report import convert_with_report
+from om2bms.report import write_report
 
 
 if __name__ == '__main__':
@@ -14,9 +21,15 @@ if __name__ == '__main__':
 
     parser.add_argument('-i', '--in_file',
                         action='store',
-                        help='Path to file to be converted.',
+                        help='Path to file to be converted. - reads the .osu file from stdin.',
                         type=str)
 
+    parser.add_argument('-so', '--stdout',
+                        action='store_true',
+                        default=False,
+                        help="Streams the converted chart to stdout as it is produced instead of writing it to the "
+                             "current directory. Messages are printed to stderr.")
+
     parser.add_argument('-hs', '--hitsound',
                         action='store_false',
                         default=True,
@@ -27,6 +40,13 @@ if __name__ == '__main__':
                         default=True,
                         help='Disables background conversion.')
 
+    parser.add_argument('-img', '--images',
+                        nargs='+',
+                        default=list(IMAGE_SIZES),
+                        choices=list(IMAGE_SIZES),
+                        help="Images made from the BG, letterboxed to the size of their header command: "
+                             "BMP01 256x256, STAGEFILE 640x480, BANNER 300x80, BACKBMP 640x480. Defaults to all.")
+
     parser.add_argument('-o', '--offset',
                         default=0,
                         type=int,
@@ -38,17 +58,77 @@ if __name__ == '__main__':
                         help="Judge difficulty. Defaults to EASY. "
                         "(3: EASY), (2: NORMAL), (1: HARD), (0: VERY HARD)")
 
+    parser.add_argument('-fmt', '--format',
+                        default='bms',
+                        choices=['bms', 'bmson'],
+                        help="Output format. bmson places notes on exact pulses instead of the BMS grid.")
+
+    parser.add_argument('-res', '--resolution',
+                        default=960,
+                        type=int,
+                        help="Pulses per beat of bmson output. Defaults to 960.")
+
+    parser.add_argument('-sp', '--split',
+                        action='store_true',
+                        default=False,
+                        help="Splits charts longer than 999 measures into several parts instead of failing. "
+                             "Parts after the first do not play the audio file.")
+
+    parser.add_argument('-pc', '--parse_cache',
+                        action='store_true',
+                        default=False,
+                        help="Keeps the parsed chart next to the .osu file (.om2bmscache) and loads it instead of "
+                             "parsing the file again while it is unchanged, e.g. when trying out offsets.")
+
+    parser.add_argument('-r', '--report',
+                        action='store_true',
+                        default=False,
+                        help="Reads the converted file back and prints its timing error against the .osu file.")
+
+    parser.add_argument('-jl', '--jsonl',
+                        action='store',
+                        default='None',
+                        help='Appends a JSON record of the conversion (status, error, note, measure and WAV counts, '
+                             'output size, wall time, warnings) to this JSON Lines file.',
+                        type=str)
+
     args = parser.parse_args()
+    if args.stdout and args.split:
+        parser.error("a split chart can not be streamed to stdout")
+    if args.stdout and args.report:
+        parser.error("the timing error can not be reported on a chart streamed to stdout")
 
     cwd = os.getcwd()
+    out_stream = sys.stdout.buffer if args.stdout else None
 
     om2bms.om_to_bms.OsuManiaToBMSParser._convertion_options = {
         "HITSOUND": args.hitsound,
         "BG": args.bg,
         "OFFSET": args.offset,
-        "JUDGE": args.judge
+        "JUDGE": args.judge,
+        "SPLIT": args.split,
+        "RESOLUTION": args.resolution,
+        "IMAGES": args.images,
+        "PARSE_CACHE": args.parse_cache,
+        "OUT_STREAM": out_stream
     }
-    convert = om2bms.om_to_bms.OsuManiaToBMSParser(
-        args.in_file, os.getcwd(), args.in_file)
-    print("Done")
+    with redirect_stdout(sys.stderr if args.stdout else sys.stdout):
+        if args.in_file == "-":
+            # the BG is looked for next to the .osu file, so a chart from stdin has none
+            om2bms.om_to_bms.OsuManiaToBMSParser._convertion_options["BG"] = False
+            in_file = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+            convert, record = convert_with_report(in_file, cwd, "<stdin>", None, args.format)
+        else:
+            convert, record = convert_with_report(args.in_file, cwd, args.in_file, None, args.format)
+        if args.jsonl != "None":
+            write_report(args.jsonl, [record])
+        if convert is None:
+            print(record["error_class"] + ": " + record["error"])
+            exit(1)
+        if not convert.failed and convert.get_bg() is not None:
+            from om2bms.image_resizer import letterbox_images
+            letterbox_images(convert.get_bg(), args.images, cwd)
+        if args.report and not convert.failed and args.format == "bms":
+            print("\tTiming error: " + str(timing_error_report(convert.output_path, convert.beatmap, args.offset)))
+        print("Done")
     exit(0)
@@ -0,0 +1,79 @@
+"""
+Writes a converted set into a single .zip or .tar instead of a directory
+"""
+import io
+import os
+import tarfile
+import time
+import zipfile
+
+
+# already compressed, so they are stored as is
+STORED_EXTENSIONS = (".mp3", ".ogg", ".wav", ".flac", ".jpg", ".jpeg", ".png")
+
+
+class SetArchive:
+    """
+    A .zip or .tar of one converted set. Every member is put in the folder foldername.
+
+    path: path of the archive file to create
+    foldername: folder of the members inside the archive
+    kind: "zip" or "tar". Zip members are deflated except audio and images, tar is not compressed
+    """
+    def __init__(self, path: str, foldername: str, kind: str = "zip"):
+        self.path = path
+        self.foldername = foldername
+        self.kind = kind
+        self.names = []
+        if kind == "zip":
+            self._archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        elif kind == "tar":
+            self._archive = tarfile.open(path, "w")
+        else:
+            raise ValueError("Unknown archive type " + kind)
+
+    def _member_name(self, name: str) -> str:
+        return self.foldername + "/" + os.path.basename(name)
+
+    def _compression(self, name: str) -> int:
+        if name.lower().endswith(STORED_EXTENSIONS):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def write(self, name: str, data: bytes) -> None:
+        """
+        Adds data as the file name
+        """
+        member = self._member_name(name)
+        if self.kind == "zip":
+            info = zipfile.ZipInfo(member, time.localtime()[:6])
+            info.compress_type = self._compression(name)
+            info.external_attr = 0o644 << 16
+            self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._archive.addfile(info, io.BytesIO(data))
+        self.names.append(member)
+
+    def add_file(self, path: str) -> None:
+        """
+        Copies the file at path into the archive
+        """
+        member = self._member_name(path)
+        if self.kind == "zip":
+            self._archive.write(path, member, self._compression(path))
+        else:
+            self._archive.add(path, member, recursive=False)
+        self.names.append(member)
+
+    def close(self) -> None:
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
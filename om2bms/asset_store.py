@@ -0,0 +1,141 @@
+"""
+Content-addressed store of the assets of converted sets. Set directories hardlink to one shared copy of each
+unique file.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from typing import Tuple
+
+
+class AssetStore:
+    """
+    root: directory of the store. Created if it does not exist.
+
+    Each unique file is kept once as root/objects/<first 2 hex digits>/<rest of sha256> and output files
+    are hardlinks to it, so editing an output file in place changes it in every set. The link count of a blob
+    is its reference count: a blob linked from no set directory has a link count of 1 and is removed by gc().
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.tmp = os.path.join(root, "tmp")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.tmp, exist_ok=True)
+
+    @staticmethod
+    def content_hash(path: str) -> str:
+        """
+        Returns the sha256 of the file at path
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def blob_path(self, digest: str) -> str:
+        """
+        Returns the path of the blob of the file with sha256 digest, whether it is stored or not
+        """
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def add(self, path: str) -> str:
+        """
+        Stores a copy of the file at path if its content is not in the store yet. Returns the blob path.
+        """
+        blob = self.blob_path(AssetStore.content_hash(path))
+        if os.path.isfile(blob):
+            return blob
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.tmp)
+        os.close(fd)
+        try:
+            shutil.copy2(path, tmp_path)
+            os.replace(tmp_path, blob)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return blob
+
+    def link(self, path: str, out_dir: str) -> bool:
+        """
+        Puts the file at path into out_dir as a hardlink to its blob. Falls back to a copy if out_dir cannot
+        hold a hardlink to the store (e.g. another file system). Returns True if the file was linked.
+        """
+        dest = os.path.join(out_dir, os.path.basename(path))
+        for _ in range(2):
+            blob = self.add(path)
+            if os.path.exists(dest):
+                if os.path.samefile(dest, blob):
+                    return True
+                os.remove(dest)
+            try:
+                os.link(blob, dest)
+                return True
+            except FileNotFoundError:
+                # removed by a gc() running at the same time, store it again
+                continue
+            except OSError:
+                break
+        shutil.copy2(path, dest)
+        return False
+
+    def blobs(self):
+        """
+        Yields the path of every blob
+        """
+        for prefix in os.listdir(self.objects):
+            directory = os.path.join(self.objects, prefix)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    yield os.path.join(directory, name)
+
+    def references(self, blob: str) -> int:
+        """
+        Returns the number of set files linking to blob
+        """
+        return os.stat(blob).st_nlink - 1
+
+    def gc(self) -> Tuple[int, int]:
+        """
+        Removes blobs no set links to anymore and temporary files older than an hour, left by interrupted
+        add()s. Returns (blobs removed, bytes freed).
+        """
+        removed = 0
+        freed = 0
+        for blob in list(self.blobs()):
+            stat = os.stat(blob)
+            if stat.st_nlink <= 1:
+                os.remove(blob)
+                removed += 1
+                freed += stat.st_size
+        for name in os.listdir(self.tmp):
+            tmp_path = os.path.join(self.tmp, name)
+            if time.time() - os.stat(tmp_path).st_mtime > 3600:
+                os.remove(tmp_path)
+        return removed, freed
+
+    def remove_set(self, directory: str) -> Tuple[int, int]:
+        """
+        Deletes a converted set directory and collects the blobs only it used. Returns gc()'s result.
+        """
+        shutil.rmtree(directory)
+        return self.gc()
+
+    def stats(self) -> Tuple[int, int, int]:
+        """
+        Returns (number of blobs, bytes stored, number of set files linking to them)
+        """
+        count = 0
+        size = 0
+        links = 0
+        for blob in self.blobs():
+            stat = os.stat(blob)
+            count += 1
+            size += stat.st_size
+            links += stat.st_nlink - 1
+        return count, size, links
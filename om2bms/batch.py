@@ -0,0 +1,524 @@
+"""
+Pipelined conversion of many .osz files
+"""
+import hashlib
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from multiprocessing import resource_tracker
+from typing import Callable, Dict, List, Tuple
+
+import om2bms.om_to_bms
+import om2bms.trace
+from om2bms.exceptions import ConversionTimeoutException
+from om2bms.exceptions import WorkerCrashedException
+from om2bms.report import convert_with_report
+from om2bms.report import new_record
+from om2bms.shared_charts import SharedCharts
+from om2bms.shared_charts import remove_stale_blocks
+from om2bms.shared_charts import tracker_lock
+from om2bms.worker_pool import WorkerPool
+
+
+def init_worker(options: Dict, trace: bool = False) -> None:
+    """
+    Sets the conversion options of a worker process, and turns on tracing if trace is set
+    """
+    om2bms.om_to_bms.OsuManiaToBMSParser._convertion_options = dict(options, WRITE_FILES=False)
+    if trace:
+        om2bms.trace.enable()
+
+
+def convert_difficulty(filedir, output_file_dir: str, file: str, osz_path: str, output_format: str) \
+        -> Tuple[str, Dict, List[Tuple[str, bytes]], List[Dict]]:
+    """
+    Converts one difficulty without writing it. filedir is a path or a SharedChart. Returns (bg filename,
+    result record, [(path, bytes)] of the converted files, trace events), see om2bms.report.convert_with_report
+    """
+    converted, record = convert_with_report(filedir, output_file_dir, file, osz_path, output_format)
+    if converted is None:
+        print(record["error"])
+        return None, record, [], om2bms.trace.collect()
+    bg = converted.get_bg() if not converted.failed else None
+    return bg, record, converted.output_data, om2bms.trace.collect()
+
+
+# a timing point starts a new measure and resets the quantization, roughly the work of this many notes
+TIMING_POINT_COST = 16
+
+
+def estimate_cost(data: bytes) -> int:
+    """
+    Returns a rough estimate of the time it takes to convert the .osu file data: its hit objects and Sample
+    events, plus TIMING_POINT_COST per timing point. Only counts lines, without parsing them.
+    """
+    cost = 0
+    section = None
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        if line.startswith("["):
+            section = line.strip()
+        elif len(line.strip()) == 0:
+            continue
+        elif section == "[HitObjects]":
+            cost += 1
+        elif section == "[TimingPoints]":
+            cost += TIMING_POINT_COST
+        elif section == "[Events]" and line.startswith("Sample"):
+            cost += 1
+    return cost
+
+
+def estimate_set_cost(osz_path: str) -> int:
+    """
+    Returns a rough estimate of the time it takes to convert the .osz at osz_path: the uncompressed size of its
+    .osu files, read from the zip directory without extracting anything. 0 if it is not a zip file.
+    """
+    try:
+        with zipfile.ZipFile(osz_path, "r") as zipf:
+            return sum(info.file_size for info in zipf.infolist() if info.filename.endswith(".osu"))
+    except (OSError, zipfile.BadZipFile):
+        return 0
+
+
+def file_checksum(path: str) -> str:
+    """
+    Returns the sha256 of the file at path
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_file(path: str, data: bytes) -> None:
+    with om2bms.trace.span("write", file=os.path.basename(path)):
+        with open(path, "wb") as fp:
+            fp.write(data)
+
+
+def copy_asset(path: str, out_dir: str) -> None:
+    with om2bms.trace.span("asset copy", file=os.path.basename(path)):
+        shutil.copy2(path, out_dir)
+
+
+def resize_bg(path: str, images: List[str], out_dir: str) -> None:
+    from om2bms.image_resizer import letterbox_images
+
+    with om2bms.trace.span("bg resize", file=os.path.basename(path)):
+        letterbox_images(path, images, out_dir)
+
+
+class WriteBehind:
+    """
+    Threads doing the file writes and copies of the writer stage, so the writer does not wait on the latency
+    of a network share for each file. Threads are enough, the work is I/O and resizing images in Pillow, which
+    releases the GIL.
+
+    writers: number of files written at the same time
+    queue_size: number of jobs waiting or running. submit() blocks past that, so converted sets do not pile up
+    in memory while the disk falls behind. Defaults to 2 * writers.
+    """
+    def __init__(self, writers: int, queue_size: int = None):
+        self._executor = ThreadPoolExecutor(max(1, writers), thread_name_prefix="om2bms_io")
+        self._slots = threading.BoundedSemaphore(queue_size or 2 * max(1, writers))
+
+    def submit(self, func: Callable, *args) -> Future:
+        """
+        Queues func(*args). Returns its Future.
+        """
+        self._slots.acquire()
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+
+
+class Journal:
+    """
+    Append-only JSON Lines log of a batch, used to resume it after a crash.
+
+    A "start" entry is written when the writer starts on a set, a "difficulty" entry with the sha256 of every
+    file once they are written, and a "set" entry once the assets are copied. A set is identified by its path,
+    size and mtime and the settings it is converted with, so a .osz that changed since, or a batch run with
+    other options, is converted again.
+
+    path: path to the journal. Created if it does not exist.
+    settings: the conversion settings of the batch, see settings_key
+    """
+    def __init__(self, path: str, settings: str = ""):
+        self.path = path
+        self.settings = settings
+        # (osz, size, mtime, settings): {"started": bool, "done": bool, "difficulties": {.osu filename: entry}}
+        self._sets = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as fp:
+                for line in fp:
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        # torn last line of a crashed run
+                        continue
+        self._fp = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def set_key(osz_path: str) -> Tuple[str, int, float]:
+        stat = os.stat(osz_path)
+        return os.path.abspath(osz_path), stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def settings_key(options: Dict, output_format: str) -> str:
+        """
+        Returns the settings of a batch converting with options to output_format, as stored in the journal
+        """
+        return hashlib.sha256(json.dumps([options, output_format], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _add(self, entry: Dict) -> None:
+        key = (entry["osz"], entry["size"], entry["mtime"], entry.get("settings", ""))
+        if key not in self._sets:
+            self._sets[key] = {"started": False, "done": False, "difficulties": {}}
+        if entry["event"] == "start":
+            self._sets[key]["started"] = True
+        elif entry["event"] == "set":
+            self._sets[key]["done"] = True
+        elif entry["event"] == "difficulty":
+            self._sets[key]["difficulties"][entry["file"]] = entry
+
+    def _get(self, osz_path: str) -> Dict:
+        return self._sets.get(Journal.set_key(osz_path) + (self.settings,),
+                              {"started": False, "done": False, "difficulties": {}})
+
+    def is_done(self, osz_path: str) -> bool:
+        """
+        True if osz_path was completely converted
+        """
+        return self._get(osz_path)["done"]
+
+    def is_started(self, osz_path: str) -> bool:
+        """
+        True if the writer started on osz_path
+        """
+        return self._get(osz_path)["started"]
+
+    def done_difficulties(self, osz_path: str) -> Dict[str, Dict]:
+        """
+        Returns {.osu filename: difficulty entry} of the difficulties of osz_path that were written. The outputs
+        of an entry are {output path: sha256}.
+        """
+        return self._get(osz_path)["difficulties"]
+
+    def append(self, event: str, osz_path: str, **fields) -> None:
+        """
+        Writes an entry and flushes it to disk
+        """
+        (osz, size, mtime) = Journal.set_key(osz_path)
+        entry = dict(fields, event=event, osz=osz, size=size, mtime=mtime, settings=self.settings)
+        with self._lock:
+            self._fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._add(entry)
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class OszSet:
+    """
+    A .osz going through the pipeline
+
+    osz_path: path to the .osz
+    output_dir: directory the converted set is published to
+    """
+    def __init__(self, osz_path: str, output_dir: str):
+        self.osz_path = osz_path
+        self.output_dir = output_dir
+        # the set is written here and renamed to output_dir once complete
+        self.staging_dir = os.path.join(os.path.dirname(output_dir), "." + os.path.basename(output_dir) + ".part")
+        self.resumed = False
+        self.io_futures = []  # WriteBehind jobs of the set
+        self.work_dir = None
+        self.shared = None  # SharedCharts of the .osu files
+        self.charts = []  # .osu filenames to convert
+        self.costs = []  # estimate_cost of charts
+        self.bgs = []  # bg filenames of the difficulties converted by a previous run
+        self.error = None
+        self.results = []  # Tasks of convert_difficulty, in the order of charts
+
+
+class BatchConverter:
+    """
+    Converts .osz files in three stages connected by bounded queues, so reading, converting and writing of
+    different sets overlap:
+
+    - a reader thread extracts the next sets into temporary directories, at most prefetch ahead. The .osu files
+      are read from the archive into shared memory instead (SharedCharts), where the workers parse them
+    - a pool of workers processes converts the difficulties. The difficulties of all sets the reader has ready
+      are handed out longest first (estimate_cost), so the batch does not end with one worker converting a
+      long chart while the others are idle. A difficulty running longer than time_budget seconds has its
+      worker killed and is recorded as failed, see WorkerPool
+    - a writer thread takes the sets in input order and hands the writes of the converted files, the BG
+      resizing and the asset copies to writer threads (WriteBehind). Each set is written into a staging
+      directory next to its output directory and published with one rename once every file is written,
+      replacing an earlier output directory. Then the temporary directory of the set is removed.
+
+    With a journal, a batch can be run again after a crash: finished sets and difficulties are skipped, and
+    the other files of an unfinished set and the temporary directories of the crashed run are removed.
+    Readers of out_dir never see a partial set.
+
+    out_dir: directory the sets are written to, each into a folder named after the .osz
+    options: OsuManiaToBMSParser conversion options
+    journal_path: path to the journal, see Journal. The temporary directories are kept in journal_path.work
+    time_budget: seconds a difficulty may take to convert. None for no limit.
+    writers: number of files written at the same time
+    trace_path: writes a trace of the run to this file, see om2bms.trace
+    """
+    def __init__(self, out_dir: str, options: Dict, output_format: str = "bms", workers: int = None,
+                 prefetch: int = 2, work_root: str = None, journal_path: str = None, time_budget: float = None,
+                 writers: int = 4, trace_path: str = None):
+        self.out_dir = out_dir
+        self.options = options
+        self.output_format = output_format
+        self.workers = workers or os.cpu_count() or 1
+        self.prefetch = max(1, prefetch)
+        self.time_budget = time_budget
+        self.writers = writers
+        self.trace_path = trace_path
+        self.trace_events = []
+        self.work_root = work_root
+        self.journal = None
+        if journal_path is not None:
+            self.journal = Journal(journal_path, Journal.settings_key(options, output_format))
+            if work_root is None:
+                self.work_root = journal_path + ".work"
+        self.records = []
+
+    def run(self, osz_paths: List[str]) -> List[Dict]:
+        """
+        Converts every .osz in osz_paths. Returns the result records of all difficulties.
+        """
+        if self.journal is not None:
+            # left behind by a crashed run
+            shutil.rmtree(self.work_root, ignore_errors=True)
+            os.makedirs(self.work_root)
+            done = [osz_path for osz_path in osz_paths if self.journal.is_done(osz_path)]
+            if len(done) > 0:
+                print("Skipping %d sets converted by a previous run" % len(done))
+            osz_paths = [osz_path for osz_path in osz_paths if osz_path not in done]
+
+        # shared by the workers, see SharedCharts
+        resource_tracker.ensure_running()
+        remove_stale_blocks()
+        read_queue = queue.Queue(self.prefetch)
+        write_queue = queue.Queue(self.prefetch)
+        reader = threading.Thread(target=self._read, args=(osz_paths, read_queue), daemon=True)
+        writer = threading.Thread(target=self._write, args=(write_queue,), daemon=True)
+        reader.start()
+        writer.start()
+        if self.trace_path is not None:
+            om2bms.trace.enable()
+        with WorkerPool(self.workers, init_worker, (self.options, self.trace_path is not None),
+                        self.time_budget, tracker_lock) as pool:
+            finished = False
+            while not finished:
+                window = [read_queue.get()]
+                while window[-1] is not None and len(window) < self.prefetch:
+                    try:
+                        window.append(read_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if window[-1] is None:
+                    finished = True
+                    window.pop()
+                tasks = []
+                for osz_set in window:
+                    osz_set.results = [None] * len(osz_set.charts)
+                    tasks += [(cost, osz_set, i) for (i, cost) in enumerate(osz_set.costs)]
+                for (_, osz_set, i) in sorted(tasks, key=lambda task: task[0], reverse=True):
+                    chart = osz_set.shared.chart(osz_set.charts[i], os.path.join(osz_set.work_dir, osz_set.charts[i]))
+                    osz_set.results[i] = pool.submit(convert_difficulty, (
+                        chart, osz_set.output_dir, osz_set.charts[i], osz_set.osz_path, self.output_format))
+                for osz_set in window:
+                    write_queue.put(osz_set)
+            write_queue.put(None)
+            writer.join()
+        reader.join()
+        if self.journal is not None:
+            self.journal.close()
+            shutil.rmtree(self.work_root, ignore_errors=True)
+        if self.trace_path is not None:
+            om2bms.trace.write_trace(self.trace_path, self.trace_events + om2bms.trace.collect())
+        return self.records
+
+    def _read(self, osz_paths: List[str], read_queue: queue.Queue) -> None:
+        """
+        Reader stage
+        """
+        try:
+            for osz_path in osz_paths:
+                foldername = os.path.splitext(os.path.basename(osz_path))[0]
+                osz_set = OszSet(os.path.abspath(osz_path), os.path.join(self.out_dir, foldername))
+                try:
+                    self._read_set(osz_set)
+                except Exception as e:
+                    # e.g. a damaged archive, only this set fails
+                    osz_set.error = e
+                read_queue.put(osz_set)
+        finally:
+            # the converter waits for it, even if the reader fails
+            read_queue.put(None)
+
+    def _read_set(self, osz_set: OszSet) -> None:
+        """
+        Extracts osz_set into a temporary directory, except its charts, which are read into shared memory
+        """
+        osz_set.work_dir = tempfile.mkdtemp(prefix="om2bms_", dir=self.work_root)
+        with om2bms.trace.span("unzip", osz=os.path.basename(osz_set.osz_path)):
+            with zipfile.ZipFile(osz_set.osz_path, "r") as zipf:
+                # the .osu files at the top of the archive go to shared memory, the rest is extracted
+                members = [info for info in zipf.infolist() if not info.is_dir()]
+                charts = {info.filename: zipf.read(info) for info in members
+                          if info.filename.endswith(".osu") and "/" not in info.filename}
+                zipf.extractall(osz_set.work_dir, [info for info in members if info.filename not in charts])
+        osz_set.shared = SharedCharts(charts)
+        osz_set.charts = sorted(charts)
+        if self.journal is not None and self.journal.is_started(osz_set.osz_path):
+            self._resume(osz_set)
+        osz_set.costs = [estimate_cost(charts[chart]) for chart in osz_set.charts]
+
+    def _resume(self, osz_set: OszSet) -> None:
+        """
+        Keeps the difficulties of an unfinished set whose files are intact and removes every other file of its
+        staging directory
+        """
+        if not os.path.isdir(osz_set.staging_dir) and os.path.isdir(osz_set.output_dir):
+            # published, but the crash came before the set was journaled
+            os.rename(osz_set.output_dir, osz_set.staging_dir)
+        keep = set()
+        for (chart, entry) in self.journal.done_difficulties(osz_set.osz_path).items():
+            # the journal has the paths in the output directory
+            staged = {os.path.join(osz_set.staging_dir, os.path.basename(path)): checksum
+                      for (path, checksum) in entry["outputs"].items()}
+            if chart in osz_set.charts and all(os.path.isfile(path) and file_checksum(path) == checksum
+                                               for (path, checksum) in staged.items()):
+                keep.update(staged)
+                osz_set.charts.remove(chart)
+                osz_set.bgs.append(entry["bg"])
+        if os.path.isdir(osz_set.staging_dir):
+            for f in os.listdir(osz_set.staging_dir):
+                path = os.path.join(osz_set.staging_dir, f)
+                if path not in keep and os.path.isfile(path):
+                    os.remove(path)
+        osz_set.resumed = True
+
+    def _write(self, write_queue: queue.Queue) -> None:
+        """
+        Writer stage
+        """
+        self._io = WriteBehind(self.writers)
+        while True:
+            osz_set = write_queue.get()
+            if osz_set is None:
+                self._io.shutdown()
+                return
+            try:
+                self._write_set(osz_set)
+            except Exception as e:
+                print(osz_set.osz_path + ": " + str(e))
+                record = new_record(None, osz_set.osz_path)
+                record.update(status="failed", error_class=type(e).__name__, error=str(e))
+                self.records.append(record)
+            finally:
+                # a failed set may still have copies from its temporary directory running
+                wait(osz_set.io_futures)
+                if osz_set.shared is not None:
+                    osz_set.shared.close()
+                if osz_set.work_dir is not None:
+                    shutil.rmtree(osz_set.work_dir, ignore_errors=True)
+
+    def _write_set(self, osz_set: OszSet) -> None:
+        """
+        Writes the converted files and the assets of osz_set into its staging directory and publishes it
+        """
+        if osz_set.error is not None:
+            raise osz_set.error
+        print("Converting " + osz_set.osz_path)
+        if self.journal is not None:
+            self.journal.append("start", osz_set.osz_path)
+        if not osz_set.resumed:
+            # left behind by a crashed run without a journal
+            shutil.rmtree(osz_set.staging_dir, ignore_errors=True)
+        os.makedirs(osz_set.staging_dir, exist_ok=True)
+        bg_list = [os.path.join(osz_set.work_dir, bg) for bg in osz_set.bgs if bg is not None]
+        # difficulties whose worker was killed or died are not journaled, a resumed batch tries them again
+        killed = 0
+        written = []
+        for (chart, result) in zip(osz_set.charts, osz_set.results):
+            try:
+                (bg, record, output_data, events) = result.get()
+            except (ConversionTimeoutException, WorkerCrashedException) as e:
+                print(os.path.join(osz_set.osz_path, chart) + ": " + str(e))
+                record = new_record(chart, osz_set.osz_path)
+                record.update(status="failed", error_class=type(e).__name__, error=str(e))
+                self.records.append(record)
+                killed += 1
+                continue
+            futures = [self._io.submit(write_file, os.path.join(osz_set.staging_dir, os.path.basename(path)), data)
+                       for (path, data) in output_data]
+            osz_set.io_futures += futures
+            written.append((chart, bg, record, output_data, futures))
+            bg_list.append(bg)
+            self.records.append(record)
+            self.trace_events += events
+
+        futures = []
+        if self.options["BG"] and any(bg is not None for bg in bg_list):
+            from om2bms.image_resizer import IMAGE_SIZES
+            for bg in set(bg for bg in bg_list if bg is not None):
+                futures.append(self._io.submit(resize_bg, bg, self.options.get("IMAGES", list(IMAGE_SIZES)),
+                                               osz_set.staging_dir))
+
+        for f in os.listdir(osz_set.work_dir):
+            full_path = os.path.join(osz_set.work_dir, f)
+            if not os.path.isdir(full_path) and not f.endswith(".zip") and not f.endswith(".osu"):
+                futures.append(self._io.submit(copy_asset, full_path, osz_set.staging_dir))
+
+        osz_set.io_futures += futures
+
+        for (chart, bg, record, output_data, chart_futures) in written:
+            for future in chart_futures:
+                future.result()
+            if self.journal is not None:
+                checksums = {path: hashlib.sha256(data).hexdigest() for (path, data) in output_data}
+                self.journal.append("difficulty", osz_set.osz_path, file=chart, status=record["status"],
+                                    bg=os.path.basename(bg) if bg is not None else None, outputs=checksums)
+        for future in futures:
+            future.result()
+        with om2bms.trace.span("publish", osz=os.path.basename(osz_set.osz_path)):
+            self._publish(osz_set)
+        if self.journal is not None and killed == 0:
+            self.journal.append("set", osz_set.osz_path)
+
+    def _publish(self, osz_set: OszSet) -> None:
+        """
+        Renames the staging directory of osz_set to its output directory, replacing an earlier one
+        """
+        old_dir = None
+        if os.path.isdir(osz_set.output_dir):
+            old_dir = osz_set.staging_dir[:-len(".part")] + ".old"
+            shutil.rmtree(old_dir, ignore_errors=True)
+            os.rename(osz_set.output_dir, old_dir)
+        os.rename(osz_set.staging_dir, osz_set.output_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
@@ -0,0 +1,214 @@
+"""
+Reads converted BMS files back into millisecond timestamps to measure the timing error of the conversion
+"""
+import codecs
+import re
+
+from typing import Dict, List, Union
+
+from om2bms.data_structures import OsuMania
+from om2bms.data_structures import OsuManiaNote
+from om2bms.data_structures import OsuManiaLongNote
+from om2bms.data_structures import OsuBGSoundEvent
+from om2bms.om_to_bms import OsuManiaToBMSParser
+
+
+class BMSChart:
+    """
+    Timed contents of a BMS file.
+
+    events: list of (time in ms, channel, object id) sorted by time
+    """
+    _data_line = re.compile(r"#(\d{3})([0-9A-Za-z]{2}):(\S*)")
+    _object_channels = {"01", "11", "12", "13", "14", "15", "16", "18", "19",
+                        "51", "52", "53", "54", "55", "56", "58", "59"}
+
+    def __init__(self):
+        self.bpm = 130.0
+        self.extended_bpm = {}
+        self.wavs = {}
+        self.events = []
+
+    def parse(self, lines):
+        """
+        Parses the header and main data field of the lines of a BMS file
+        """
+        measure_lengths = {}
+        # measure -> list of (position, bpm)
+        bpm_changes = {}
+        # measure -> list of (position, channel, object id)
+        objects = {}
+        last_measure = 0
+        for line in lines:
+            line = line.strip()
+            if not line.startswith("#"):
+                continue
+            match = BMSChart._data_line.match(line)
+            if match is None:
+                self.parse_header(line)
+                continue
+            measure = int(match.group(1))
+            channel = match.group(2).upper()
+            data = match.group(3)
+            last_measure = max(last_measure, measure)
+            if channel == "02":
+                measure_lengths[measure] = float(data)
+                continue
+            slots = len(data) // 2
+            for i in range(slots):
+                value = data[i * 2:i * 2 + 2].upper()
+                if value == "00":
+                    continue
+                if channel == "03":
+                    bpm_changes.setdefault(measure, []).append((i / slots, int(value, 16)))
+                elif channel == "08":
+                    bpm_changes.setdefault(measure, []).append((i / slots, self.extended_bpm[value]))
+                elif channel in BMSChart._object_channels:
+                    objects.setdefault(measure, []).append((i / slots, channel, value))
+
+        measure_start = 0.0
+        bpm = self.bpm
+        for measure in range(last_measure + 1):
+            beats = 4 * measure_lengths.get(measure, 1)
+            changes = sorted(bpm_changes.get(measure, []), key=lambda x: x[0])
+            # (start position, start ms, bpm) of each constant tempo segment in the measure
+            segments = [(0.0, measure_start, bpm)]
+            for (position, new_bpm) in changes:
+                start_position, start_ms, segment_bpm = segments[-1]
+                segments.append((position, start_ms + (position - start_position) * beats * 60000 / segment_bpm,
+                                 new_bpm))
+                bpm = new_bpm
+            for (position, channel, value) in objects.get(measure, []):
+                segment = segments[0]
+                for e in segments:
+                    if e[0] <= position:
+                        segment = e
+                time = segment[1] + (position - segment[0]) * beats * 60000 / segment[2]
+                self.events.append((time, channel, value))
+            start_position, start_ms, segment_bpm = segments[-1]
+            measure_start = start_ms + (1 - start_position) * beats * 60000 / segment_bpm
+        self.events.sort(key=lambda x: x[0])
+
+    def parse_header(self, line):
+        """
+        Parses the header commands needed for timing and sound lookup
+        """
+        command, _, value = line.partition(" ")
+        command = command.upper()
+        value = value.strip()
+        if command == "#BPM":
+            self.bpm = float(value)
+        elif command.startswith("#BPM") and len(command) == 6:
+            self.extended_bpm[command[4:6]] = float(value)
+        elif command.startswith("#WAV") and len(command) == 6:
+            self.wavs[command[4:6]] = value
+
+
+def read_bms(path) -> BMSChart:
+    """
+    Reads the BMS file at path
+    """
+    chart = BMSChart()
+    with codecs.open(path, "r", "shiftjis", errors="replace") as file:
+        chart.parse(file)
+    return chart
+
+
+class TimingReport:
+    """
+    Timing error of converted objects against the source .osu objects, in ms.
+    errors are signed (BMS time - osu time).
+    """
+    def __init__(self, errors: List[float], unmatched: int):
+        self.errors = errors
+        self.unmatched = unmatched
+        absolute = sorted(abs(e) for e in errors)
+        self.count = len(errors)
+        if self.count > 0:
+            self.max = absolute[-1]
+            self.mean = sum(absolute) / self.count
+            self.p99 = absolute[min(self.count - 1, int(0.99 * self.count))]
+            self.mean_signed = sum(errors) / self.count
+        else:
+            self.max = self.mean = self.p99 = self.mean_signed = 0.0
+
+    def __str__(self):
+        return "objects=%d unmatched=%d max=%.2fms mean=%.2fms p99=%.2fms mean_signed=%+.2fms" % \
+               (self.count, self.unmatched, self.max, self.mean, self.p99, self.mean_signed)
+
+
+def source_channel_times(beatmap: OsuMania) -> Dict[str, List[int]]:
+    """
+    Returns the osu times of beatmap's objects grouped by the BMS channel they are written to
+    """
+    channels = {}
+    for obj in beatmap.objects:
+        if isinstance(obj, OsuManiaNote):
+            channel = OsuManiaToBMSParser._mania_note_to_channel[obj.mania_column]
+        elif isinstance(obj, OsuManiaLongNote):
+            channel = OsuManiaToBMSParser._mania_ln_to_channel[obj.mania_column]
+        elif isinstance(obj, OsuBGSoundEvent):
+            channel = 1
+        else:
+            continue
+        channels.setdefault(str(channel).zfill(2), []).append(obj.time)
+    return channels
+
+
+def timing_error_report(chart: Union[BMSChart, str], beatmap: OsuMania, offset: int = 0) -> TimingReport:
+    """
+    Compares the objects of a converted chart to the objects of the beatmap it was converted from.
+    Objects are paired in time order per channel. The music start (the BGM object playing the audio file)
+    is time 0. offset is the -o offset the chart was converted with and is removed from the errors.
+    """
+    if isinstance(chart, str):
+        chart = read_bms(chart)
+    audio_id = "01"
+    for (wav_id, filename) in chart.wavs.items():
+        if filename == beatmap.audio_filename:
+            audio_id = wav_id
+            break
+
+    music_start = None
+    converted = {}
+    for (time, channel, value) in chart.events:
+        if channel == "01" and value == audio_id and music_start is None:
+            music_start = time
+            continue
+        converted.setdefault(channel, []).append(time)
+    if music_start is None:
+        music_start = 0.0
+
+    errors = []
+    unmatched = 0
+    source = source_channel_times(beatmap)
+    for channel in set(source.keys()) | set(converted.keys()):
+        source_times = sorted(source.get(channel, []))
+        converted_times = [time - music_start + offset for time in converted.get(channel, [])]
+        channel_errors = match_times(source_times, converted_times)
+        errors += channel_errors
+        unmatched += len(source_times) + len(converted_times) - 2 * len(channel_errors)
+    return TimingReport(errors, unmatched)
+
+
+def match_times(source_times: List[float], converted_times: List[float]) -> List[float]:
+    """
+    Pairs two sorted lists of times in order and returns the errors (converted - source) of the pairs.
+    An object is left unpaired when the next object of the other list is closer to its counterpart,
+    so a dropped or duplicated object does not shift every following pair.
+    """
+    errors = []
+    i = j = 0
+    while i < len(source_times) and j < len(converted_times):
+        error = converted_times[j] - source_times[i]
+        if i + 1 < len(source_times) and len(source_times) - i > len(converted_times) - j and \
+                abs(converted_times[j] - source_times[i + 1]) < abs(error):
+            i += 1
+        elif j + 1 < len(converted_times) and len(converted_times) - j > len(source_times) - i and \
+                abs(converted_times[j + 1] - source_times[i]) < abs(error):
+            j += 1
+        else:
+            errors.append(error)
+            i += 1
+            j += 1
+    return errors
@@ -0,0 +1,104 @@
+"""
+NumPy bulk parser for the [HitObjects] section, used by OsuBeatmapReader when NumPy is installed
+"""
+import importlib.util
+
+from typing import List
+
+from om2bms.data_structures import OsuMania
+from om2bms.data_structures import HitSound
+from om2bms.data_structures import OsuManiaNote
+from om2bms.data_structures import OsuManiaLongNote
+from om2bms.exceptions import OsuParseException
+
+
+# importing NumPy takes longer than parsing a few thousand lines one by one
+MIN_LINES = 5000
+
+
+def available() -> bool:
+    """
+    True if NumPy is installed
+    """
+    return importlib.util.find_spec("numpy") is not None
+
+
+def parse_hitobjects(lines: List[str], beatmap: OsuMania, sample_index: int) -> int:
+    """
+    Parses the lines of the [HitObjects] section into beatmap like OsuBeatmapReader's header_hitobjects.
+    x, time, type and hitsound of all lines are read into arrays at once and columns, timing points and
+    hitsound bits are worked out as array operations. Only the extras field is split per line.
+    Returns the sample index of the next new hitsound.
+
+    Raises ValueError before beatmap is changed if a line cannot be read this way.
+    """
+    import numpy as np
+
+    if len(lines) == 0:
+        return sample_index
+    columns = np.loadtxt(lines, delimiter=",", usecols=(0, 2, 3, 4), dtype=np.int64, ndmin=2)
+    x, time, hit_object_type, hitsound_raw = columns.T
+
+    known = np.isin(hit_object_type, [1, 5, 2, 6, 8, 12, 128, 132])
+    if not known.all():
+        line = lines[int(np.argmin(known))]
+        raise OsuParseException("HitObject Error: type " + line.split(",")[3] + " not found in " + line)
+    # o!std sliders and spinners are skipped
+    keep = np.flatnonzero(np.isin(hit_object_type, [1, 5, 128, 132]))
+    x, time, hit_object_type, hitsound_raw = x[keep], time[keep], hit_object_type[keep], hitsound_raw[keep]
+    is_ln = hit_object_type >= 128
+
+    if beatmap.key_count == 7:
+        mania_column = np.where(x == 0, 0, x // (512 // 7) + 1)
+    else:
+        mania_column = x // (512 // beatmap.key_count)
+
+    # for when sample_set plays > 1 hitsound at the same time, take only the largest
+    hitsound_int = np.where(np.isin(hitsound_raw, [0, 1, 2, 4, 8]), hitsound_raw,
+                            np.select([hitsound_raw > 8, hitsound_raw > 4, hitsound_raw > 2], [8, 4, 2], 1))
+
+    # latest timing point at or before each object
+    tp_times = np.array([tp.time for tp in beatmap.timing_points])
+    tp_index = np.maximum.accumulate(np.maximum(np.searchsorted(tp_times, time, side="right") - 1, 0))
+
+    extras = []
+    for (i, ln) in zip(keep.tolist(), is_ln.tolist()):
+        hit_object_arg = lines[i][lines[i].rindex(",") + 1:].split(":")
+        if ln:
+            filename = "" if len(hit_object_arg) < 5 else hit_object_arg[5].strip()
+            extras.append((int(hit_object_arg[0]), int(hit_object_arg[1]), int(hit_object_arg[3]), filename))
+        else:
+            filename = "" if len(hit_object_arg) < 4 else hit_object_arg[4].strip()
+            extras.append((None, int(hit_object_arg[0]), int(hit_object_arg[2]), filename))
+
+    new_combo = np.isin(hit_object_type, [5, 128]).tolist()
+    rows = zip(extras, time.tolist(), mania_column.tolist(), hitsound_int.tolist(), tp_index.tolist(), new_combo)
+    for ((end_time, sample_set, custom_index, filename), t, column, hs, tp, combo) in rows:
+        timing_point = beatmap.timing_points[tp]
+        if filename == "" and hs == 0:
+            hitsound = None
+        else:
+            if sample_set == 0:
+                sample_set = timing_point.sample_set
+            hs_id = (hs, sample_set, custom_index, filename)
+            if hs_id not in beatmap.hitsounds:
+                hitsound = HitSound(hs, timing_point, sample_set, custom_index, filename, sample_index)
+                sample_index += 1
+                beatmap.hitsounds[hs_id] = hitsound
+                beatmap.hitsound_names.append(hitsound.get_info())
+            else:
+                hitsound = beatmap.hitsounds[hs_id]
+
+        hit_object = OsuManiaNote() if end_time is None else OsuManiaLongNote(end_time)
+        hit_object.new_combo = combo
+        hit_object.time = t
+        hit_object.mania_column = column
+        hit_object.hit_sound = hitsound
+        hit_object.timing_point = timing_point
+        beatmap.hit_objects.append(hit_object)
+        if end_time is not None:
+            ln_buffer = OsuManiaLongNote(end_time)
+            ln_buffer.time = end_time
+            ln_buffer.mania_column = hit_object.mania_column
+            beatmap.hit_objects.append(ln_buffer)
+    return sample_index
@@ -1,6 +1,9 @@
+import warnings
+
 from typing import Union, List, Tuple, Dict
 
 from om2bms.exceptions import BMSHitSoundException
+from om2bms.exceptions import ConversionWarning
 
 
 class OsuMania:
@@ -26,7 +29,7 @@ class OsuMania:
         self.key_count = None  # originally circle size
         self.od = None
 
-        self.float_bpm = []
+        self.float_bpm = {}  # bpm: #BPMxx index
         self.timing_points = []
         self.hit_objects = []
         self.sample_objects = []
@@ -41,12 +44,10 @@ class OsuMania:
 
     def parse_float_bpm(self, bpm: float):
         """
-        Parse float bpm into (INDEX, BPM)
+        Gives float bpm the next #BPMxx index
         """
-        for e in self.float_bpm:
-            if e[1] == bpm:
-                return
-        self.float_bpm.append((get_current_hs_count(len(self.float_bpm) + 1), bpm))
+        if bpm not in self.float_bpm:
+            self.float_bpm[bpm] = get_current_hs_count(len(self.float_bpm) + 1)
 
 
 class OsuTimingPoint:
@@ -62,6 +63,7 @@ class OsuTimingPoint:
         self.kiai_mode = None  # not needed
 
         self.ms_per_measure = None
+        self.bpm = None  # calculate_bpm of uninherited timing points, set by normalize_timing_points
 
         self.sort_type = 0  # for sorting
 
@@ -255,15 +257,11 @@ class BMSMeasure:
         """
         self.lines.append(BMSMainDataLine("03", 1, {0: str(hex(bpm))[2:4].upper().zfill(2)}, [0], self.measure_number))
 
-    def create_bpm_extended_change_line(self, bpm: Union[int, float], float_bpm_arr):
+    def create_bpm_extended_change_line(self, bpm: Union[int, float], float_bpm: Dict[Union[int, float], str]):
         """
         Channel 8 bpm change. Takes real number.
         """
-        tup = (None, None)
-        for e in float_bpm_arr:
-            if e[1] == bpm:
-                tup = e
-        self.lines.append(BMSMainDataLine("08", 1, {0: str(tup[0])}, [0], self.measure_number))
+        self.lines.append(BMSMainDataLine("08", 1, {0: str(float_bpm.get(bpm))}, [0], self.measure_number))
 
 
 class BMSMainDataLine:
@@ -319,7 +317,7 @@ def get_current_hs_count(sample_num: int) -> str:
         ret = "0" + ret
     elif len(ret) > 2 or ret == "ZZ":
         # raise BMSHitSoundException("Too many hitsounds.")
-        print("Too many hitsounds - continuing")
+        warnings.warn("Too many hitsounds - continuing", ConversionWarning)
         return ""
     return ret
 
@@ -347,3 +345,41 @@ def calculate_bpm(timing_point: OsuTimingPoint) -> Union[int, float]:
         return round(bpm_float)
     else:
         return int(bpm_float * (10 ** 4)) / 10000
+
+
+def normalize_timing_points(beatmap: OsuMania) -> int:
+    """
+    Removes the inherited timing points that do not change the sample set or sample index. BMS has no SV, so
+    the remaining inherited points are only there for hitsound lookups. Sets bpm of the uninherited points
+    and builds beatmap.float_bpm from them. Returns the number of timing points removed.
+    """
+    timing_points = []
+    for tp in beatmap.timing_points:
+        if tp.inherited and len(timing_points) > 0 and tp.sample_set == timing_points[-1].sample_set and \
+                tp.sample_index == timing_points[-1].sample_index:
+            continue
+        timing_points.append(tp)
+    removed = len(beatmap.timing_points) - len(timing_points)
+    beatmap.timing_points = timing_points
+
+    beatmap.float_bpm = {}
+    for tp in beatmap.noninherited_tp:
+        tp.bpm = calculate_bpm(tp)
+        if isinstance(tp.bpm, float) or tp.bpm > 255:
+            beatmap.parse_float_bpm(tp.bpm)
+    return removed
+
+
+def count_notes(beatmap: OsuMania) -> int:
+    """
+    Returns the number of playable notes. Long notes count once.
+    """
+    notes = 0
+    long_notes = 0
+    for obj in beatmap.hit_objects:
+        if isinstance(obj, OsuManiaNote):
+            notes += 1
+        elif isinstance(obj, OsuManiaLongNote):
+            long_notes += 1
+    # long notes are stored as a head and a tail object
+    return notes + long_notes // 2
@@ -21,3 +21,18 @@ class BMSHitSoundException(Exception):
 class BMSMaxMeasuresException(Exception):
     """BMS files only support up to 999 measures."""
     pass
+
+
+class ConversionTimeoutException(Exception):
+    """A difficulty took longer than the time budget of the batch. Its worker process was killed."""
+    pass
+
+
+class WorkerCrashedException(Exception):
+    """The worker process converting a difficulty exited without a result."""
+    pass
+
+
+class ConversionWarning(UserWarning):
+    """Problems that do not stop the conversion. Collected into the conversion report."""
+    pass
@@ -1,13 +1,68 @@
 """
-Resizes BG to 256x256
+Resizes BG to the images shown by BMS players
 """
-from PIL import Image
+import os
+
+from typing import Dict, List, Tuple
+
+
+# header command: size of the image it shows
+IMAGE_SIZES = {
+    "BMP01": (256, 256),
+    "STAGEFILE": (640, 480),
+    "BANNER": (300, 80),
+    "BACKBMP": (640, 480)
+}
+
+
+def image_name(filename: str, size: Tuple[int, int]) -> str:
+    """
+    Returns the filename of the copy of image filename letterboxed to size, e.g. bg_640x480.jpg for bg.jpg
+    """
+    (stem, ext) = os.path.splitext(filename)
+    return "%s_%dx%d%s" % (stem, size[0], size[1], ext)
+
+
+def letterbox_images(path_to_image: str, commands: List[str], out_dir: str = None) -> Dict[str, str]:
+    """
+    Decodes the image once and writes a copy letterboxed with black borders for the size of each header
+    command in commands, named by image_name, into out_dir (defaults to the directory of the image). Commands
+    of the same size share one file. The image itself is left unchanged. Returns {command: path}.
+    """
+    from PIL import Image
+
+    if out_dir is None:
+        out_dir = os.path.dirname(path_to_image)
+    sizes = sorted(set(IMAGE_SIZES[command] for command in commands))
+    paths = {}
+    if len(sizes) == 0:
+        return paths
+    with Image.open(path_to_image) as source_image:
+        # JPEGs are decoded at the smallest scale that still covers the largest size
+        source_image.draft("RGB", (max(w for (w, _) in sizes), max(h for (_, h) in sizes)))
+        source_image = source_image.convert("RGB")
+    for size in sizes:
+        image = source_image.copy()
+        image.thumbnail(size)
+        background = Image.new('RGB', size, "black")
+        background.paste(image, ((size[0] - image.size[0]) // 2, (size[1] - image.size[1]) // 2))
+        path = os.path.join(out_dir, image_name(os.path.basename(path_to_image), size))
+        background.save(path)
+        background.close()
+        image.close()
+        for command in commands:
+            if IMAGE_SIZES[command] == size:
+                paths[command] = path
+    source_image.close()
+    return paths
 
 
 def black_background_thumbnail(path_to_image, thumbnail_size=(256, 256)):
     """
     Resizes image to 256x256. Add black borders if image is widescreen.
     """
+    from PIL import Image
+
     background = Image.new('RGB', thumbnail_size, "black")
     source_image = Image.open(path_to_image).convert("RGB")
     # if source_image.verify():
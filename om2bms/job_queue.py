@@ -0,0 +1,264 @@
+"""
+Job queue in a shared directory, for converting a library on several machines
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from typing import Dict, List, Union
+
+from om2bms.batch import BatchConverter
+
+
+class JobQueue:
+    """
+    Queue of .osz conversion jobs kept as JSON files in a directory every machine can reach:
+
+    - pending/: jobs waiting for a worker
+    - leased/: jobs a worker is converting. A worker claims a job by renaming it from pending/ to a lease file
+      named after the job and a new lease id, and renews the lease by touching that file. A lease not renewed
+      for lease_seconds has expired, and reap() puts the job back into pending/, or into failed/ after
+      max_attempts.
+    - done/: the jobs with the result records of their difficulties
+
+    Renames are atomic, so each job is claimed by exactly one worker. The lease file is renamed again before
+    the job is moved on, so only one of the worker and reap() can complete or release a lease, and a worker
+    whose lease was given to another worker can not renew or release the new lease.
+
+    root: directory of the queue. Created if it does not exist.
+    """
+    _states = ("pending", "leased", "done", "failed")
+
+    def __init__(self, root: str, lease_seconds: float = 60, max_attempts: int = 3):
+        self.root = root
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for state in JobQueue._states:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    def _path(self, state: str, job_id: str) -> str:
+        return os.path.join(self.root, state, job_id + ".json")
+
+    def _lease_path(self, job: Dict) -> str:
+        return os.path.join(self.root, "leased", job["id"] + "." + job["lease"] + ".json")
+
+    def _write(self, state: str, job: Dict) -> None:
+        """
+        Writes job into state, atomically
+        """
+        path = self._lease_path(job) if state == "leased" else self._path(state, job["id"])
+        tmp_path = os.path.join(self.root, job["id"] + "." + uuid.uuid4().hex + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(job, fp, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> Union[Dict, None]:
+        try:
+            with open(path, "r", encoding="utf-8") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def jobs(self, state: str) -> List[str]:
+        """
+        Returns the ids of the jobs in state, oldest first
+        """
+        # job ids have no dot, lease files are [id].[lease].json or .closing
+        return sorted(set(f.split(".")[0] for f in os.listdir(os.path.join(self.root, state))))
+
+    def _now(self) -> float:
+        """
+        Returns the current time of the file system of the queue, which sets the mtimes of the lease files. It
+        can differ from the clock of this machine.
+        """
+        path = os.path.join(self.root, "clock")
+        with open(path, "a"):
+            pass
+        os.utime(path)
+        return os.stat(path).st_mtime
+
+    def submit(self, osz_path: str, out_dir: str, options: Dict, output_format: str = "bms") -> str:
+        """
+        Adds a job converting osz_path into out_dir. Returns its id.
+        """
+        job_id = "%016d-%s" % (int(time.time() * 1000000), uuid.uuid4().hex[:8])
+        self._write("pending", {
+            "id": job_id,
+            "osz": os.path.abspath(osz_path),
+            "out_dir": os.path.abspath(out_dir),
+            "options": options,
+            "format": output_format,
+            "attempts": 0,
+            "worker": None,
+            "lease": None,
+            "errors": []
+        })
+        return job_id
+
+    def claim(self, worker: str) -> Union[Dict, None]:
+        """
+        Leases the oldest pending job to worker. Returns the job, or None if there is none.
+        """
+        for job_id in self.jobs("pending"):
+            path = self._path("pending", job_id)
+            lease = uuid.uuid4().hex
+            lease_path = os.path.join(self.root, "leased", job_id + "." + lease + ".json")
+            try:
+                # the rename keeps the mtime of when the job was submitted, which reap() would take as expired
+                os.utime(path)
+                os.rename(path, lease_path)
+            except OSError:
+                # claimed by another worker
+                continue
+            job = self._read(lease_path)
+            if job is None:
+                continue
+            job["attempts"] += 1
+            job["worker"] = worker
+            job["lease"] = lease
+            self._write("leased", job)
+            return job
+        return None
+
+    def renew(self, job: Dict) -> bool:
+        """
+        Renews the lease of job. Returns False if it was lost to reap()
+        """
+        try:
+            os.utime(self._lease_path(job))
+            return True
+        except OSError:
+            return False
+
+    def _close_lease(self, job: Dict, state: str, closed_job: Dict) -> bool:
+        """
+        Ends the lease of job and writes closed_job into state. Returns False, and writes nothing, if the lease
+        was lost to reap() or to another worker.
+        """
+        lease_path = self._lease_path(job)
+        closing_path = lease_path[:-len(".json")] + ".closing"
+        try:
+            # renew() and reap() no longer find the lease
+            os.rename(lease_path, closing_path)
+            os.utime(closing_path)
+        except OSError:
+            return False
+        self._write(state, closed_job)
+        os.remove(closing_path)
+        return True
+
+    def complete(self, job: Dict, records: List[Dict]) -> bool:
+        """
+        Moves a leased job to done/ with its result records. Returns False if the lease was lost.
+        """
+        return self._close_lease(job, "done", dict(job, records=records))
+
+    def release(self, job: Dict, error: str) -> bool:
+        """
+        Gives a leased job back after it failed, to be retried or moved to failed/. Returns False if the lease
+        was lost.
+        """
+        released = dict(job, worker=None, lease=None, errors=job["errors"] + [error])
+        return self._close_lease(job, "pending" if job["attempts"] < self.max_attempts else "failed", released)
+
+    def reap(self) -> int:
+        """
+        Releases the jobs whose lease expired, e.g. because their worker died. Returns how many.
+        """
+        reaped = 0
+        now = self._now()
+        for f in os.listdir(os.path.join(self.root, "leased")):
+            path = os.path.join(self.root, "leased", f)
+            if len(f.split(".")) != 3:
+                continue
+            (job_id, lease, extension) = f.split(".")
+            try:
+                expired = now - os.stat(path).st_mtime > self.lease_seconds
+            except OSError:
+                continue
+            if not expired:
+                continue
+            if extension == "closing":
+                # its worker died while closing the lease
+                if any(os.path.isfile(self._path(state, job_id)) for state in ("pending", "done", "failed")) or \
+                        any(g.startswith(job_id + ".") and g != f
+                            for g in os.listdir(os.path.join(self.root, "leased"))):
+                    os.remove(path)
+                else:
+                    # nothing was written, expire the lease again
+                    os.rename(path, os.path.join(self.root, "leased", job_id + "." + lease + ".json"))
+                continue
+            job = self._read(path)
+            if job is None:
+                continue
+            # a worker that died right after claiming the job has not written its lease into the job yet
+            job["lease"] = lease
+            if self.release(job, "lease of " + str(job["worker"]) + " expired"):
+                reaped += 1
+        return reaped
+
+    def is_finished(self) -> bool:
+        """
+        True if no job is pending or leased
+        """
+        return len(self.jobs("pending")) == 0 and len(self.jobs("leased")) == 0
+
+    def results(self, job_ids: List[str]) -> List[Dict]:
+        """
+        Returns the jobs of job_ids that are in done/ or failed/
+        """
+        ret = []
+        for job_id in job_ids:
+            for state in ("done", "failed"):
+                job = self._read(self._path(state, job_id))
+                if job is not None:
+                    ret.append(job)
+                    break
+        return ret
+
+
+def run_worker(job_queue: JobQueue, workers: int = None, poll_seconds: float = 2, name: str = None,
+               time_budget: float = None) -> int:
+    """
+    Converts jobs of job_queue with BatchConverter until no job is pending or leased. Returns the number of
+    jobs converted. time_budget is the time_budget of the BatchConverter.
+    """
+    name = name or socket.gethostname() + ":" + str(os.getpid())
+    converted = 0
+    while True:
+        job = job_queue.claim(name)
+        if job is None:
+            if job_queue.is_finished():
+                return converted
+            # jobs of other workers may come back if their lease expires
+            time.sleep(poll_seconds)
+            continue
+
+        print("%s: converting %s (attempt %d)" % (name, job["osz"], job["attempts"]))
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(job_queue, job, stop), daemon=True)
+        heartbeat.start()
+        try:
+            records = BatchConverter(job["out_dir"], job["options"], job["format"], workers,
+                                     time_budget=time_budget).run([job["osz"]])
+        except Exception as e:
+            stop.set()
+            job_queue.release(job, name + ": " + type(e).__name__ + ": " + str(e))
+            continue
+        stop.set()
+        heartbeat.join()
+        # a job whose lease expired was given to another worker
+        if job_queue.complete(job, records):
+            converted += 1
+
+
+def _heartbeat(job_queue: JobQueue, job: Dict, stop: threading.Event) -> None:
+    """
+    Renews the lease of job until stop is set
+    """
+    while not stop.wait(job_queue.lease_seconds / 3):
+        if not job_queue.renew(job):
+            return
@@ -0,0 +1,231 @@
+"""
+SQLite index of scanned and converted beatmaps
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import time
+import zipfile
+
+from typing import List, Tuple, Union
+
+from om2bms.data_structures import OsuMania
+from om2bms.data_structures import count_notes
+from om2bms.osu import OsuBeatmapReader
+from om2bms.exceptions import OsuGameTypeException
+from om2bms.exceptions import OsuParseException
+
+
+def file_hash(data: bytes) -> str:
+    """
+    Returns the hash used to key charts in the index
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+class LibraryIndex:
+    """
+    db_path: path to the sqlite database. Created if it does not exist.
+
+    Charts are keyed by (path, member). path is the .osz or .osu on disk, member is the
+    .osu filename inside the .osz ("" for loose .osu files).
+    """
+    _schema = """
+        CREATE TABLE IF NOT EXISTS charts (
+            path TEXT NOT NULL,
+            member TEXT NOT NULL,
+            sha1 TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            convertible INTEGER NOT NULL,
+            scan_error TEXT,
+            title TEXT,
+            version TEXT,
+            key_count INTEGER,
+            min_bpm REAL,
+            max_bpm REAL,
+            note_count INTEGER,
+            measure_count INTEGER,
+            output_path TEXT,
+            status TEXT NOT NULL DEFAULT 'new',
+            status_error TEXT,
+            converted_sha1 TEXT,
+            scanned_at REAL,
+            converted_at REAL,
+            PRIMARY KEY (path, member)
+        );
+        CREATE INDEX IF NOT EXISTS charts_sha1 ON charts (sha1);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(LibraryIndex._schema)
+
+    def close(self):
+        """
+        Commits and closes the database
+        """
+        self.connection.commit()
+        self.connection.close()
+
+    def scan(self, directory) -> Tuple[int, int]:
+        """
+        Walks directory for .osz and .osu files and updates the index. Files whose size and
+        mtime did not change are not read again; charts whose hash did not change are not
+        parsed again. Returns (number of charts parsed, number of charts removed).
+        """
+        parsed = 0
+        seen = set()
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                extension = os.path.splitext(name)[1].lower()
+                if extension not in (".osz", ".osu"):
+                    continue
+                path = os.path.abspath(os.path.join(root, name))
+                seen.add(path)
+                stat = os.stat(path)
+                if self._is_unchanged(path, stat):
+                    continue
+                if extension == ".osz":
+                    parsed += self._scan_osz(path, stat)
+                else:
+                    with open(path, "rb") as fp:
+                        data = fp.read()
+                    parsed += self._scan_chart(path, "", data, stat)
+
+        removed = 0
+        prefix = os.path.join(os.path.abspath(directory), "")
+        for row in self.connection.execute("SELECT DISTINCT path FROM charts").fetchall():
+            if row["path"].startswith(prefix) and row["path"] not in seen:
+                removed += self.connection.execute("DELETE FROM charts WHERE path = ?",
+                                                   (row["path"],)).rowcount
+        self.connection.commit()
+        return (parsed, removed)
+
+    def _is_unchanged(self, path, stat) -> bool:
+        """
+        True if every indexed chart of path has the same size and mtime as stat
+        """
+        rows = self.connection.execute("SELECT size, mtime FROM charts WHERE path = ?", (path,)).fetchall()
+        if len(rows) == 0:
+            return False
+        return all(row["size"] == stat.st_size and row["mtime"] == stat.st_mtime for row in rows)
+
+    def _scan_osz(self, path, stat) -> int:
+        """
+        Indexes every .osu in the archive at path
+        """
+        parsed = 0
+        members = []
+        try:
+            with zipfile.ZipFile(path, 'r') as zipf:
+                for info in zipf.infolist():
+                    if info.filename.lower().endswith(".osu"):
+                        members.append(info.filename)
+                        parsed += self._scan_chart(path, info.filename, zipf.read(info), stat)
+        except zipfile.BadZipFile as e:
+            members.append("")
+            self._store_scan(path, "", file_hash(b""), stat, None, "BadZipFile: " + str(e))
+        placeholders = ",".join("?" * len(members))
+        self.connection.execute("DELETE FROM charts WHERE path = ? AND member NOT IN (" + placeholders + ")",
+                                [path] + members)
+        return parsed
+
+    def _scan_chart(self, path, member, data: bytes, stat) -> int:
+        """
+        Parses a chart unless a chart with the same hash is already indexed at (path, member)
+        """
+        sha1 = file_hash(data)
+        row = self.connection.execute("SELECT sha1 FROM charts WHERE path = ? AND member = ?",
+                                      (path, member)).fetchone()
+        if row is not None and row["sha1"] == sha1:
+            self.connection.execute("UPDATE charts SET size = ?, mtime = ? WHERE path = ? AND member = ?",
+                                    (stat.st_size, stat.st_mtime, path, member))
+            return 0
+        beatmap = None
+        error = None
+        try:
+            beatmap = OsuBeatmapReader(io.StringIO(data.decode("utf-8"))).get_parsed_beatmap()
+            if len(beatmap.objects) == 0 or len(beatmap.noninherited_tp) == 0:
+                beatmap = None
+                error = "No hit objects or timing points"
+        except OsuGameTypeException:
+            error = "Not an osu!mania beatmap"
+        except (OsuParseException, UnicodeDecodeError) as e:
+            error = str(e)
+        except (IndexError, ValueError, KeyError) as e:
+            error = type(e).__name__ + ": " + str(e)
+        self._store_scan(path, member, sha1, stat, beatmap, error)
+        return 1
+
+    def _store_scan(self, path, member, sha1, stat, beatmap: Union[OsuMania, None], error):
+        """
+        Inserts or replaces the scanned metadata of a chart. Conversion results are kept.
+        """
+        values = {
+            "path": path,
+            "member": member,
+            "sha1": sha1,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "convertible": beatmap is not None,
+            "scan_error": error,
+            "title": None,
+            "version": None,
+            "key_count": None,
+            "min_bpm": None,
+            "max_bpm": None,
+            "note_count": None,
+            "scanned_at": time.time()
+        }
+        if beatmap is not None:
+            bpms = [tp.bpm for tp in beatmap.noninherited_tp]
+            values.update({
+                "title": beatmap.title,
+                "version": beatmap.version,
+                "key_count": beatmap.key_count,
+                "min_bpm": min(bpms),
+                "max_bpm": max(bpms),
+                "note_count": count_notes(beatmap)
+            })
+        columns = ", ".join(values.keys())
+        updates = ", ".join(key + " = excluded." + key for key in values.keys())
+        self.connection.execute("INSERT INTO charts (" + columns + ") VALUES (" +
+                                ", ".join(":" + key for key in values.keys()) + ") "
+                                "ON CONFLICT (path, member) DO UPDATE SET " + updates, values)
+
+    def record_conversion(self, path, member, sha1, output_path, measure_count, status, error=None):
+        """
+        Stores the result of converting a chart. sha1 is the hash of the converted .osu.
+        """
+        self.connection.execute("UPDATE charts SET output_path = ?, measure_count = ?, status = ?, "
+                                "status_error = ?, converted_sha1 = ?, converted_at = ? "
+                                "WHERE path = ? AND member = ?",
+                                (output_path, measure_count, status, error, sha1, time.time(),
+                                 os.path.abspath(path), member))
+        self.connection.commit()
+
+    def pending(self, key_count=None) -> List[sqlite3.Row]:
+        """
+        Returns convertible charts that were never converted successfully or have changed since
+        """
+        query = "SELECT * FROM charts WHERE convertible = 1 AND " \
+                "(status != 'ok' OR converted_sha1 IS NULL OR converted_sha1 != sha1)"
+        params = []
+        if key_count is not None:
+            query += " AND key_count = ?"
+            params.append(key_count)
+        return self.connection.execute(query + " ORDER BY path, member", params).fetchall()
+
+    def pending_sets(self, key_count=None) -> List[str]:
+        """
+        Returns the paths of .osz/.osu files with at least one pending chart
+        """
+        paths = []
+        for row in self.pending(key_count):
+            if row["path"] not in paths:
+                paths.append(row["path"])
+        return paths
@@ -1,11 +1,9 @@
-import codecs
+import io
 import os
 import re
 
 from typing import Union, List, Tuple, Dict
 from fractions import Fraction
-from math import gcd
-from functools import reduce
 
 # import om2bms.image_resizer
 from om2bms.data_structures import OsuMania
@@ -19,13 +17,35 @@ from om2bms.osu import OsuBeatmapReader
 from om2bms.exceptions import OsuGameTypeException
 from om2bms.exceptions import OsuParseException
 from om2bms.exceptions import BMSMaxMeasuresException
+from om2bms.image_resizer import IMAGE_SIZES
+from om2bms.image_resizer import image_name
+from om2bms.quantize import quantization_cache
+from om2bms.quantize import split_lines
+from om2bms.timeline import Measure
+from om2bms.timeline import MeasureTimeline
+from om2bms.trace import add_span
+from om2bms.trace import clock
+
+
+class _StreamOutput:
+    """
+    Output of a chart written to the binary stream as it is produced, instead of being kept in memory
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str) -> None:
+        self.stream.write(text.encode("shiftjis", errors="replace"))
 
 
 class OsuManiaToBMSParser:
     """
-    in_file: path to osu file to convert
+    in_file: path to osu file to convert, or an opened text file
     out_dir: directory to output the converted bms file
     filename: the name to print to console when converting
+
+    If the conversion option OUT_STREAM is set to a binary stream, the chart is written to it measure by measure
+    instead of to out_dir, and output_data stays empty.
     """
     _ms_to_inverse_note_values = {}
     _mania_note_to_channel = {
@@ -54,34 +74,74 @@ class OsuManiaToBMSParser:
     def __init__(self, in_file, out_dir, filename):
         self.reset()
         self.bg_filename = None
+        self.output_path = None
+        self.output_paths = []
+        self.output_data = []
+        self.measure_count = 0
         self.failed = False
+        self.error = None
+        start = clock()
         try:
-            self.beatmap = OsuBeatmapReader(in_file)
-        except OsuGameTypeException:
+            self.beatmap = OsuBeatmapReader(in_file,
+                                            OsuManiaToBMSParser._convertion_options.get("PARSE_CACHE", False))
+        except OsuGameTypeException as e:
             self.failed = True
+            self.error = e
             return
         except OsuParseException as e:
             self.failed = True
+            self.error = e
             print(e)
             return
         print("\tConverting " + filename)
 
         self.beatmap = self.beatmap.get_parsed_beatmap()
+        add_span("parse", start, file=filename)
+        start = clock()
 
-        bms_filename = self.beatmap.title + " " + self.beatmap.version + ".bms"
+        bms_filename = self.beatmap.title + " " + self.beatmap.version
         bms_filename = re.sub('[\\/:"*?<>|]+', "", bms_filename)
-        output = os.path.join(out_dir, bms_filename)
-        OsuManiaToBMSParser._out_file = codecs.open(output, "w", "shiftjis", errors="replace")
-
-        self.write_buffer(self.create_header())
+        OsuManiaToBMSParser._out_file = io.StringIO()
         music_start_param = self.music_start_time(self.beatmap)
-        self.get_next_measure(music_start_param[0], music_start_param[1], self.beatmap)
-
-        OsuManiaToBMSParser._out_file.close()
+        music_start = OsuManiaToBMSParser._out_file.getvalue()
+        timeline = MeasureTimeline.get(self.beatmap.noninherited_tp, music_start_param[0], music_start_param[1])
+        measures = timeline.assign(self.beatmap.objects)
+        parts = self.split_measures(measures)
+        stream = OsuManiaToBMSParser._convertion_options.get("OUT_STREAM")
+        if len(parts) > 1 and (stream is not None or not OsuManiaToBMSParser._convertion_options.get("SPLIT", False)):
+            raise BMSMaxMeasuresException("Exceeded 999 measures (" + str(measures[-1][0].number) + ")")
+
+        outputs = []
+        for i in range(len(parts)):
+            OsuManiaToBMSParser._out_file = io.StringIO() if stream is None else _StreamOutput(stream)
+            if i == 0:
+                self.write_buffer(self.create_header(None, 1, len(parts)))
+                OsuManiaToBMSParser._out_file.write(music_start)
+            else:
+                self.write_buffer(self.create_header(parts[i][0][0].timing_point, i + 1, len(parts)))
+            self.write_measures(parts[i], parts[i][0][0].number - 1 if i > 0 else 0, measures[0][0].number)
+            if stream is not None:
+                stream.flush()
+                continue
+            part_filename = bms_filename if len(parts) == 1 else bms_filename + " (part " + str(i + 1) + ")"
+            outputs.append((os.path.join(out_dir, part_filename + ".bms"), OsuManiaToBMSParser._out_file.getvalue()))
+        OsuManiaToBMSParser._out_file = None
 
-        file = os.path.dirname(in_file)
+        # only write once the whole chart is converted so failures leave no partial files behind
+        self.output_data = [(output, text.encode("shiftjis", errors="replace")) for (output, text) in outputs]
+        add_span("quantize/emit", start, file=filename)
+        if OsuManiaToBMSParser._convertion_options.get("WRITE_FILES", True):
+            for (output, data) in self.output_data:
+                with open(output, "wb") as fp:
+                    fp.write(data)
+        self.output_paths = [output for (output, _) in outputs]
+        self.output_path = self.output_paths[0] if stream is None else None
+
+        # the BG of a chart read from a file object is looked for next to its name, if it has one
+        path = in_file if isinstance(in_file, str) else getattr(in_file, "name", None)
+        file = os.path.dirname(path) if isinstance(path, str) else None
         if OsuManiaToBMSParser._convertion_options["BG"] and self.beatmap.stagebg is not None and \
-                os.path.isfile(os.path.join(file, self.beatmap.stagebg)):
+                file is not None and os.path.isfile(os.path.join(file, self.beatmap.stagebg)):
             # om2bms.image_resizer.black_background_thumbnail(os.path.join(file, self.beatmap.stagebg))
             self.bg_filename = os.path.join(file, self.beatmap.stagebg)
 
@@ -91,6 +151,14 @@ class OsuManiaToBMSParser:
         """
         return self.bg_filename
 
+    def get_images(self) -> List[str]:
+        """
+        Returns the header commands of the images made from the BG, see om2bms.image_resizer.letterbox_images
+        """
+        if self.beatmap.stagebg is None or not OsuManiaToBMSParser._convertion_options["BG"]:
+            return []
+        return OsuManiaToBMSParser._convertion_options.get("IMAGES", list(IMAGE_SIZES))
+
     def reset(self):
         """
         Resets class variables
@@ -116,66 +184,15 @@ class OsuManiaToBMSParser:
                 OsuManiaToBMSParser._out_file.write("\n")
         OsuManiaToBMSParser._out_file.write("\n")
 
-    def expansion_wrapper(self, n, ms_per_measure) -> Fraction:
+    def expansion_wrapper(self, offset, ms_per_measure) -> Fraction:
         """
-        Approximates n, where 0 < n < 1, to p/q where q=2^i or 3 * 2^i up to q=192.
+        Approximates offset / ms_per_measure, where 0 < offset < ms_per_measure, to p/q where q=2^i or 3 * 2^i
+        up to q=192. Results are kept in quantization_cache for the rest of the process.
         """
-        def expander(n, ms_per_measure, meter, end):
-            """
-            Generalized expander for non upper number of 3 or 4 measures.
-            """
-            def within_offset(num, sum__, offset):
-                """
-                return true if within
-                """
-                return int(ms_per_measure * num) - 1 < ms_per_measure * (sum__ + offset) < int(ms_per_measure * num) + 2
-            done = False
-            denominator = meter
-            sum_ = Fraction(1, meter)
-            while sum_ + Fraction(1, denominator) < n:
-                sum_ += Fraction(1, denominator)
-            iterations = 0
-            while iterations < 6:
-                if within_offset(n, sum_, 0) or round(n, 5) == round(float(sum_), 5):
-                    done = True
-                    break
-                if float(sum_) > n:
-                    sum_ -= Fraction(1, denominator)
-                    denominator *= 2
-                elif float(sum_) < n:
-                    sum_ += Fraction(1, denominator)
-                    denominator *= 2
-                iterations += 1
-            # pad with maxs
-            while not done:
-                if within_offset(n, sum_, 0):
-                    break
-                prev_error = abs(n - sum_)
-                if sum_ > n:
-                    if within_offset(n, sum_, -Fraction(1, end)):
-                        sum_ -= Fraction(1, end)
-                        break
-                    elif abs(n - (prev_error - Fraction(1, end))) > sum_ - Fraction(1, end):
-                        break
-                    sum_ -= Fraction(1, end)
-                elif sum_ < n:
-                    if within_offset(n, sum_, Fraction(1, end)):
-                        sum_ += Fraction(1, end)
-                        break
-                    elif abs(n - (prev_error + Fraction(1, end))) < sum_ - Fraction(1, end):
-                        break
-                    sum_ += Fraction(1, end)
-            return (abs(n - sum_), sum_)
-
-        error2 = expander(n, ms_per_measure, 4, 128)
-        error3 = expander(n, ms_per_measure, 3, 192)
-        error = error2 if error2[0] < error3[0] else error3
-        time_value = error[1]
-        if time_value == 1:
-            return Fraction(0, 1)
+        time_value = quantization_cache.get(offset, ms_per_measure)
         if time_value != 0:
             self.add_to_mtnv(time_value * ms_per_measure, time_value)
-        return error[1]
+        return time_value
 
     def music_start_time(self, beatmap: OsuMania):
         """
@@ -205,8 +222,7 @@ class OsuManiaToBMSParser:
 
         mus_start_at_001 = True if first_object.time + ms_per_measure < ms_per_measure else False
 
-        sto_fraction = start_time_offset / ms_per_measure
-        time_value_ratio = self.expansion_wrapper(sto_fraction, ms_per_measure)
+        time_value_ratio = self.expansion_wrapper(start_time_offset, ms_per_measure)
         if time_value_ratio == 0 and mus_start_at_001:
             bms_measure = BMSMeasure("001")
             measure_start = 1
@@ -251,127 +267,88 @@ class OsuManiaToBMSParser:
             measure_offset -= 1
             first_measure_time -= ms_per_measure
         if time_value_ratio == 0 and not mus_start_at_001:
-            while not self.within_2_ms(start_time, measure_offset * ms_per_measure):
+            first_offset = measure_offset
+            while measure_offset * ms_per_measure < start_time - 2:
                 measure_offset += 1
+            # no measure starts within 2 ms of start_time: take the nearest one instead of searching forever
+            if not self.within_2_ms(start_time, measure_offset * ms_per_measure) \
+                    and measure_offset > first_offset \
+                    and start_time - (measure_offset - 1) * ms_per_measure \
+                    < measure_offset * ms_per_measure - start_time:
+                measure_offset -= 1
 
         self.initialize_mtnv()
         return (measure_offset, first_measure_time)
 
-    def get_next_measure(self, starting_measure: int, starting_ms: int, beatmap: OsuMania):
+    def add_to_measure(self, current_measure, hitobj):
         """
-        Retrieves information for each measure.
+        Adds hitobj to the line of its channel in current_measure
         """
-        def add_to_measure(current_measure_, hitobjj_):
-            """
-            Adds hitobj to measure
-            """
-            if isinstance(hitobjj_, OsuManiaNote):
-                column = hitobjj_.mania_column
-                bmscolumn = OsuManiaToBMSParser._mania_note_to_channel[column]
-                if bmscolumn not in current_measure_:
-                    current_measure_[OsuManiaToBMSParser._mania_note_to_channel[column]] = [hitobjj_]
-                else:
-                    current_measure_[OsuManiaToBMSParser._mania_note_to_channel[column]].append(hitobjj_)
-            elif isinstance(hitobjj_, OsuManiaLongNote):
-                column = hitobjj_.mania_column
-                bmscolumn = OsuManiaToBMSParser._mania_ln_to_channel[column]
-                if bmscolumn not in current_measure_:
-                    current_measure_[OsuManiaToBMSParser._mania_ln_to_channel[column]] = [hitobjj_]
-                else:
-                    current_measure_[OsuManiaToBMSParser._mania_ln_to_channel[column]].append(hitobjj_)
-            elif isinstance(hitobjj_, OsuBGSoundEvent):
-                column = 1
-                if column not in current_measure_:
-                    current_measure_[column] = [hitobjj_]
-                else:
-                    current_measure_[column].append(hitobjj_)
-            elif isinstance(hitobjj_, OsuTimingPoint):
-                if 0 not in current_measure_:
-                    current_measure_[0] = [hitobjj_]
-                else:
-                    current_measure_[0] = [hitobjj_]
-
-        current_measure = {}
-
-        current_time_in_ms = starting_ms
-        truncate_measure = False
-        first_timing = beatmap.noninherited_tp[0]
-        ms_per_measure = first_timing.ms_per_beat * first_timing.meter
-        measure_number = starting_measure
-        most_recent_tp = first_timing
-        i = 0
-        while i < len(beatmap.objects):
-            hitobj = beatmap.objects[i]
-
-            if hitobj.time < int(current_time_in_ms + ms_per_measure) - 1 and not truncate_measure:
-                if not isinstance(hitobj, OsuTimingPoint):
-                    add_to_measure(current_measure, hitobj)
-                elif isinstance(hitobj, OsuTimingPoint) and self.within_2_ms(current_time_in_ms, hitobj.time):
-                    most_recent_tp = hitobj
-                    ms_per_measure = hitobj.ms_per_beat * hitobj.meter
-                    current_time_in_ms = hitobj.time
-                    add_to_measure(current_measure, hitobj)
-                else:
-                    truncate_measure = True
-            else:  # hitobj.starttime >= current_time_in_ms + ms_per_measure:
-                if truncate_measure:
-                    if hitobj.time - current_time_in_ms < 0:
-                        truncation_frac = (hitobj.time - (current_time_in_ms - ms_per_measure)) / ms_per_measure
-                    else:
-                        truncation_frac = (hitobj.time - current_time_in_ms) / ms_per_measure
-                    truncation_float = float(self.expansion_wrapper(truncation_frac, ms_per_measure))
-                    bmsmeasure = self.create_measure(current_measure, most_recent_tp, current_time_in_ms,
-                                                     str(measure_number).zfill(3),
-                                                     truncation_float)
-                    truncate_measure = False
-                    self.write_buffer(bmsmeasure)
-                    self.initialize_mtnv()
-                    measure_number += 1
-                    most_recent_tp = hitobj
-                    ms_per_measure = hitobj.ms_per_beat * hitobj.meter
-                    current_time_in_ms = hitobj.time
-                    current_measure = {}
-                    add_to_measure(current_measure, hitobj)
-
-                    i += 1
-                    continue
-                else:
-                    bmsmeasure = self.create_measure(current_measure, most_recent_tp, current_time_in_ms,
-                                                     str(measure_number).zfill(3), 0)
-
-                self.write_buffer(bmsmeasure)
-
-                # move to next measure with hitnotes
-                while not self.within_2_ms(current_time_in_ms, hitobj.time):
-                    measure_number += 1
-                    current_time_in_ms += ms_per_measure
-
-                    if hitobj.time < int(current_time_in_ms + ms_per_measure) - 1:
-                        if isinstance(hitobj, OsuTimingPoint) and not self.within_2_ms(current_time_in_ms, hitobj.time):
-                            truncate_measure = True
-                        elif isinstance(hitobj, OsuTimingPoint) and self.within_2_ms(current_time_in_ms, hitobj.time):
-                            most_recent_tp = hitobj
-                            self.initialize_mtnv()
-                            ms_per_measure = hitobj.ms_per_beat * hitobj.meter
-                            current_time_in_ms = hitobj.time
-                        current_measure = {}
-                        add_to_measure(current_measure, hitobj)
-                        break
-
-                if measure_number > 999:
-                    raise BMSMaxMeasuresException("Exceeded 999 measures")
-
-            if not truncate_measure:
-                i += 1
+        if isinstance(hitobj, OsuManiaNote):
+            key = OsuManiaToBMSParser._mania_note_to_channel[hitobj.mania_column]
+        elif isinstance(hitobj, OsuManiaLongNote):
+            key = OsuManiaToBMSParser._mania_ln_to_channel[hitobj.mania_column]
+        elif isinstance(hitobj, OsuBGSoundEvent):
+            key = 1
+        elif isinstance(hitobj, OsuTimingPoint):
+            current_measure[0] = [hitobj]
+            return
+        else:
+            return
+        if key not in current_measure:
+            current_measure[key] = [hitobj]
+        else:
+            current_measure[key].append(hitobj)
 
-        # for the last measure (outside loop)
-        bmsmeasure = self.create_measure(current_measure, most_recent_tp, current_time_in_ms,
-                                         str(measure_number).zfill(3), 0)
-        self.write_buffer(bmsmeasure)
+    def split_measures(self, measures: List[Tuple[Measure, list]]) -> List[List[Tuple[Measure, list]]]:
+        """
+        Splits measures into parts of at most 999 measures. The first part keeps its measure numbers,
+        later parts are renumbered from 001.
+        """
+        parts = [[]]
+        part_end = 999
+        for (measure, objects) in measures:
+            if measure.number > part_end:
+                parts.append([])
+                part_end = measure.number + 998
+            parts[-1].append((measure, objects))
+        return parts
+
+    def write_measures(self, measures: List[Tuple[Measure, list]], number_offset: int, starting_measure: int):
+        """
+        Places the objects into their measures and writes each measure. number_offset is subtracted
+        from the measure numbers. starting_measure is the number of the first measure of the timeline.
+        """
+        for (measure, objects) in measures:
+            measure_number = measure.number - number_offset
+            current_measure = {}
+            if measure.starts_with is not None:
+                # a timing point reached before any note of the measure starts a new mtnv
+                if len(objects) == 0 or objects[0].time >= measure.started_by.time:
+                    self.initialize_mtnv()
+                self.add_to_measure(current_measure, measure.starts_with)
+            elif measure.truncated_by is not None and len(objects) == 0 and measure.number != starting_measure:
+                # an empty truncated measure carries the timing point that truncates it
+                self.add_to_measure(current_measure, measure.truncated_by)
+            for hitobj in objects:
+                self.add_to_measure(current_measure, hitobj)
+            if len(current_measure) == 0:
+                continue
+
+            if measure.truncation != 0:
+                # the truncation point is a snapped offset like any note
+                self.add_to_mtnv(measure.truncation * measure.ms_per_measure, measure.truncation)
+            bmsmeasure = self.create_measure(current_measure, measure.timing_point, measure.start_ms,
+                                             str(measure_number).zfill(3), float(measure.truncation))
+            self.write_buffer(bmsmeasure)
+            if measure.truncated_by is not None:
+                self.initialize_mtnv()
+        self.measure_count += measure_number + 1
 
     def initialize_mtnv(self) -> None:
         """
-        Reset _ms_to_inverse_note_values (bpm changes)
+        Reset _ms_to_inverse_note_values (bpm changes). It snaps notes 1 ms apart to the same position within
+        a measure, quantization_cache keeps the exact results across measures and difficulties.
         """
         OsuManiaToBMSParser._ms_to_inverse_note_values = {}
 
@@ -394,27 +371,6 @@ class OsuManiaToBMSParser:
         """
         Creates a BMSMeasure containing linedata
         """
-        def get_numerator_with_gcd(fraction, gcd_) -> int:
-            """
-            Returns numerator of fraction with denom of gcd
-            """
-            if fraction[1] == gcd_:
-                return fraction[0]
-            elif fraction[1] < gcd_:
-                fraction[0] *= 2
-                fraction[1] *= 2
-                return get_numerator_with_gcd(fraction, gcd_)
-            else:  # fraction[1] > gcd: (switch from
-                if fraction[1] % 3 == 0:
-                    fraction[0] //= 3
-                    fraction[1] //= 3
-                else:
-                    fraction[0] //= 4
-                    fraction[0] *= 3
-                    fraction[1] //= 4
-                    fraction[1] *= 3
-                return get_numerator_with_gcd(fraction, gcd_)
-
         #  if the measure is empty skip
         if len(current_measure) == 0:
             return
@@ -430,7 +386,6 @@ class OsuManiaToBMSParser:
         if len(current_measure) != 0:
             for key in sorted(current_measure.keys()):
                 # get notes from column/key and put them into a line
-                denoms = []
                 locations = []  # temp
                 locations_ = []  # to be passed into bmsmaindataline
                 for note in current_measure[key]:
@@ -441,12 +396,11 @@ class OsuManiaToBMSParser:
                     elif int(time_value_ms) in OsuManiaToBMSParser._ms_to_inverse_note_values:
                         time_value_ratio = OsuManiaToBMSParser._ms_to_inverse_note_values[int(time_value_ms)]
                     else:
-                        time_value_ratio = self.expansion_wrapper(time_value_ms / ms_per_measure, ms_per_measure)
-                    denoms.append(time_value_ratio.denominator)
+                        time_value_ratio = self.expansion_wrapper(time_value_ms, ms_per_measure)
                     locations.append(([time_value_ratio.numerator, time_value_ratio.denominator], note))
 
                 if key == 0 and not current_measure[key][0].inherited:
-                    new_bpm = calculate_bpm(current_measure[key][0])
+                    new_bpm = current_measure[key][0].bpm
                     if new_bpm <= 255 and isinstance(new_bpm, int):
                         bms_measure.create_bpm_change_line(new_bpm)
                     else:
@@ -457,17 +411,19 @@ class OsuManiaToBMSParser:
                         bms_measure.create_data_line(str(key).zfill(2), locations_[i][0][1],
                                                      [(locations_[i][0][0], locations_[i][1])])
                 else:
-                    # make all denomaintors = to gcd
-                    gcd_ = reduce(lambda a, b: a * b // gcd(a, b), denoms)
-                    for list_ in locations:
-                        locations_.append((get_numerator_with_gcd(list_[0], gcd_), list_[1]))
-                    bms_measure.create_data_line(str(key).zfill(2), gcd_, sorted(locations_, key=lambda x: x[0]))
+                    # each line uses the smallest resolution that holds its notes exactly
+                    positions = [Fraction(e[0][0], e[0][1]) for e in locations]
+                    for (resolution, indexes) in split_lines(positions):
+                        locations_ = [(int(positions[i] * resolution), locations[i][1]) for i in indexes]
+                        bms_measure.create_data_line(str(key).zfill(2), resolution,
+                                                     sorted(locations_, key=lambda x: x[0]))
 
             return bms_measure
 
-    def create_header(self) -> List[str]:
+    def create_header(self, timing_point: OsuTimingPoint = None, part: int = 1, parts: int = 1) -> List[str]:
         """
-        Makes everything before maindata field
+        Makes everything before maindata field. timing_point sets the exact #BPM of a part that does not
+        start at the first timing point. Charts split into several parts get the part number in #SUBTITLE.
         """
         # HEADER FIELD
         buffer = list([""])
@@ -476,22 +432,30 @@ class OsuManiaToBMSParser:
         buffer.append("#PLAYER 1")
         buffer.append("#GENRE " + self.beatmap.creator)
         buffer.append("#TITLE " + self.beatmap.title_unicode)
-        buffer.append("#SUBTITLE " + self.beatmap.version)
+        if parts > 1:
+            buffer.append("#SUBTITLE " + self.beatmap.version + " (" + str(part) + "/" + str(parts) + ")")
+        else:
+            buffer.append("#SUBTITLE " + self.beatmap.version)
         buffer.append("#ARTIST " + self.beatmap.artist_unicode)
         # buffer.append("#SUBARTIST " + beatmap.artist)
-        buffer.append("#BPM " + str(int(calculate_bpm(self.beatmap.timing_points[0]))))
+        if timing_point is None:
+            buffer.append("#BPM " + str(int(calculate_bpm(self.beatmap.timing_points[0]))))
+        else:
+            buffer.append("#BPM " + str(timing_point.bpm))
         buffer.append("#DIFFICULTY " + "5")
         buffer.append("#RANK " + str(OsuManiaToBMSParser._convertion_options["JUDGE"]))
         buffer.append("")
         for hs in self.beatmap.hitsound_names:
             buffer.append("#WAV" + hs[0] + " " + str(hs[1]))
         buffer.append("")
-        if self.beatmap.stagebg is not None and OsuManiaToBMSParser._convertion_options["BG"]:
-            buffer.append("#BMP01 " + self.beatmap.stagebg)
+        images = self.get_images()
+        for command in images:
+            buffer.append("#" + command + " " + image_name(self.beatmap.stagebg, IMAGE_SIZES[command]))
+        if len(images) > 0:
             buffer.append("")
         if len(self.beatmap.float_bpm) > 0:
-            for e in self.beatmap.float_bpm:
-                buffer.append("#BPM" + str(e[0]) + " " + str(e[1]))
+            for (bpm, index) in self.beatmap.float_bpm.items():
+                buffer.append("#BPM" + index + " " + str(bpm))
             buffer.append("")
         # BGM FIELD
         buffer.append("*---------------------- EXPANSION FIELD")
@@ -500,7 +464,7 @@ class OsuManiaToBMSParser:
         buffer.append("*---------------------- MAIN DATA FIELD")
         buffer.append("")
         buffer.append("")
-        if self.beatmap.stagebg is not None and OsuManiaToBMSParser._convertion_options["BG"]:
+        if "BMP01" in images:
             buffer.append("#00004:01")
 
         return buffer
@@ -0,0 +1,247 @@
+import json
+import math
+import os
+import re
+
+from bisect import bisect_right
+from fractions import Fraction
+from typing import Dict, List
+
+from om2bms.data_structures import OsuMania
+from om2bms.data_structures import OsuManiaLongNote
+from om2bms.image_resizer import IMAGE_SIZES
+from om2bms.image_resizer import image_name
+from om2bms.osu import OsuBeatmapReader
+from om2bms.om_to_bms import OsuManiaToBMSParser
+from om2bms.exceptions import OsuGameTypeException
+from om2bms.exceptions import OsuParseException
+from om2bms.trace import add_span
+from om2bms.trace import clock
+
+
+class PulseTimeline:
+    """
+    Maps osu times to bmson pulses using the uninherited timing points.
+
+    Each timing point is placed on the pulse nearest to its time, measured from where the previous timing
+    point actually landed, so rounding never adds up over many timing points. Objects are rounded to the
+    nearest pulse from the timing point before them, an error of at most half a pulse.
+    """
+    def __init__(self, noninherited_tp, resolution: int, earliest_ms: float):
+        self.resolution = resolution
+        self.timing_points = noninherited_tp
+        first = noninherited_tp[0]
+        # start on a whole number of measures before the first timing point so every pulse is positive
+        lead_in = max(0, math.ceil((first.time - earliest_ms) / (first.ms_per_beat * first.meter)))
+        # (realized time in ms, pulse, ms per beat) of each timing point
+        self.segments = [(Fraction(first.time), lead_in * first.meter * resolution, Fraction(first.ms_per_beat))]
+        for tp in noninherited_tp[1:]:
+            (time, pulse, ms_per_beat) = self.segments[-1]
+            pulses = round((tp.time - time) * resolution / ms_per_beat)
+            self.segments.append((time + pulses * ms_per_beat / resolution, pulse + pulses,
+                                  Fraction(tp.ms_per_beat)))
+        self._times = [tp.time for tp in noninherited_tp]
+
+    def pulse(self, time) -> int:
+        """
+        Returns the pulse of the osu time in ms
+        """
+        i = max(0, bisect_right(self._times, time) - 1)
+        (start, pulse, ms_per_beat) = self.segments[i]
+        ret = pulse + round((time - start) * self.resolution / ms_per_beat)
+        # stay between the timing points around time, where the pulse length is ms_per_beat / resolution
+        if time >= self._times[i]:
+            ret = max(ret, pulse)
+        if i + 1 < len(self.segments):
+            ret = min(ret, self.segments[i + 1][1])
+        return ret
+
+    def bar_lines(self, last_pulse: int) -> List[int]:
+        """
+        Returns the pulses of the bar lines from pulse 0 up to the end of the measure containing last_pulse
+        """
+        lines = []
+        pulse = 0
+        for i in range(len(self.segments)):
+            end = self.segments[i + 1][1] if i + 1 < len(self.segments) else None
+            step = self.timing_points[i].meter * self.resolution
+            if i == 0:
+                # lead-in measures
+                pulse = self.segments[0][1] % step
+            else:
+                pulse = self.segments[i][1]
+            while (end is None and pulse <= last_pulse) or (end is not None and pulse < end):
+                lines.append(pulse)
+                pulse += step
+        if len(lines) == 0 or lines[-1] <= last_pulse:
+            lines.append(pulse)
+        return lines
+
+
+class OsuManiaToBmsonParser:
+    """
+    Converts a .osu file to a bmson file. Same interface and conversion options as OsuManiaToBMSParser.
+
+    in_file: path to osu file to convert, or an opened text file
+    out_dir: directory to output the converted bmson file
+    filename: the name to print to console when converting
+    """
+    # bmson beat-7k lanes: 1-7 keys, 8 scratch
+    _mania_column_to_lane = {
+        0: 8,
+        1: 1,
+        2: 2,
+        3: 3,
+        4: 4,
+        5: 5,
+        6: 6,
+        7: 7
+    }
+    # BMS #RANK to bmson judge_rank
+    _rank_to_judge_rank = {
+        0: 25,
+        1: 50,
+        2: 75,
+        3: 100
+    }
+
+    def __init__(self, in_file, out_dir, filename):
+        self.bg_filename = None
+        self.output_path = None
+        self.output_paths = []
+        self.output_data = []
+        self.measure_count = 0
+        self.failed = False
+        self.error = None
+        start = clock()
+        try:
+            self.beatmap = OsuBeatmapReader(in_file,
+                                            OsuManiaToBMSParser._convertion_options.get("PARSE_CACHE", False))
+        except OsuGameTypeException as e:
+            self.failed = True
+            self.error = e
+            return
+        except OsuParseException as e:
+            self.failed = True
+            self.error = e
+            print(e)
+            return
+        print("\tConverting " + filename)
+
+        self.beatmap = self.beatmap.get_parsed_beatmap()
+        add_span("parse", start, file=filename)
+        start = clock()
+
+        bmson_filename = self.beatmap.title + " " + self.beatmap.version + ".bmson"
+        bmson_filename = re.sub('[\\/:"*?<>|]+', "", bmson_filename)
+        output = os.path.join(out_dir, bmson_filename)
+        chart = self.create_bmson(self.beatmap)
+        data = json.dumps(chart, ensure_ascii=False).encode("utf-8")
+        add_span("quantize/emit", start, file=filename)
+        stream = OsuManiaToBMSParser._convertion_options.get("OUT_STREAM")
+        if stream is not None:
+            stream.write(data)
+            stream.flush()
+        else:
+            self.output_data = [(output, data)]
+            if OsuManiaToBMSParser._convertion_options.get("WRITE_FILES", True):
+                with open(output, "wb") as fp:
+                    fp.write(data)
+            self.output_path = output
+            self.output_paths = [output]
+
+        path = in_file if isinstance(in_file, str) else getattr(in_file, "name", None)
+        file = os.path.dirname(path) if isinstance(path, str) else None
+        if OsuManiaToBMSParser._convertion_options["BG"] and self.beatmap.stagebg is not None and \
+                file is not None and os.path.isfile(os.path.join(file, self.beatmap.stagebg)):
+            self.bg_filename = os.path.join(file, self.beatmap.stagebg)
+
+    def get_bg(self):
+        """
+        Returns bg filename
+        """
+        return self.bg_filename
+
+    def create_bmson(self, beatmap: OsuMania) -> Dict:
+        """
+        Returns the bmson document of beatmap
+        """
+        options = OsuManiaToBMSParser._convertion_options
+        resolution = options.get("RESOLUTION", 960)
+        music_start = options["OFFSET"]
+        times = [obj.time for obj in beatmap.objects] + [music_start]
+        timeline = PulseTimeline(beatmap.noninherited_tp, resolution, min(times))
+
+        channels = {}
+
+        def add_note(name, note):
+            if name not in channels:
+                channels[name] = []
+            channels[name].append(note)
+
+        add_note(beatmap.audio_filename, {"x": 0, "y": timeline.pulse(music_start), "l": 0, "c": False})
+        for sample in beatmap.sample_objects:
+            add_note(sample.filename, {"x": 0, "y": timeline.pulse(sample.time), "l": 0, "c": False})
+
+        hit_objects = beatmap.hit_objects
+        i = 0
+        while i < len(hit_objects):
+            hit_object = hit_objects[i]
+            y = timeline.pulse(hit_object.time)
+            length = 0
+            if isinstance(hit_object, OsuManiaLongNote):
+                # the long note head is followed by its tail
+                length = timeline.pulse(hit_object.end_time) - y
+                i += 2
+            else:
+                i += 1
+            name = ""
+            if hit_object.hit_sound is not None and options["HITSOUND"]:
+                name = hit_object.hit_sound.filename
+            add_note(name, {"x": OsuManiaToBmsonParser._mania_column_to_lane[hit_object.mania_column], "y": y,
+                            "l": length, "c": False})
+
+        sound_channels = []
+        for (name, notes) in channels.items():
+            sound_channels.append({"name": name, "notes": sorted(notes, key=lambda x: (x["y"], x["x"]))})
+
+        last_pulse = max(note["y"] + note["l"] for notes in channels.values() for note in notes)
+        lines = timeline.bar_lines(last_pulse)
+        self.measure_count = len(lines) - 1
+
+        images = {}
+        if beatmap.stagebg is not None and options["BG"]:
+            images = {command: image_name(beatmap.stagebg, IMAGE_SIZES[command])
+                      for command in options.get("IMAGES", list(IMAGE_SIZES))}
+        return {
+            "version": "1.0.0",
+            "info": {
+                "title": beatmap.title_unicode,
+                "subtitle": beatmap.version,
+                "artist": beatmap.artist_unicode,
+                "subartists": [],
+                "genre": beatmap.creator,
+                "mode_hint": "beat-7k",
+                "chart_name": beatmap.version,
+                "level": 0,
+                "init_bpm": 60000 / beatmap.noninherited_tp[0].ms_per_beat,
+                "judge_rank": OsuManiaToBmsonParser._rank_to_judge_rank.get(options["JUDGE"], 100),
+                "total": 100,
+                "back_image": images.get("BACKBMP", ""),
+                "eyecatch_image": images.get("STAGEFILE", ""),
+                "banner_image": images.get("BANNER", ""),
+                "preview_music": "",
+                "resolution": resolution
+            },
+            "lines": [{"y": y} for y in lines],
+            "bpm_events": [{"y": pulse, "bpm": 60000 / tp.ms_per_beat}
+                           for (tp, (_, pulse, _)) in zip(beatmap.noninherited_tp[1:], timeline.segments[1:])],
+            "stop_events": [],
+            "sound_channels": sound_channels,
+            "bga": {
+                "bga_header": [{"id": 1, "name": images["BMP01"]}] if "BMP01" in images else [],
+                "bga_events": [{"y": 0, "id": 1}] if "BMP01" in images else [],
+                "layer_events": [],
+                "poor_events": []
+            }
+        }
@@ -1,5 +1,6 @@
 import copy
 import codecs
+import io
 
 from om2bms.data_structures import OsuMania
 from om2bms.data_structures import OsuTimingPoint
@@ -7,20 +8,40 @@ from om2bms.data_structures import OsuBGSoundEvent
 from om2bms.data_structures import HitSound
 from om2bms.data_structures import OsuManiaNote
 from om2bms.data_structures import OsuManiaLongNote
-from om2bms.data_structures import calculate_bpm
+from om2bms.data_structures import normalize_timing_points
 from om2bms.exceptions import OsuGameTypeException
 from om2bms.exceptions import OsuParseException
+from om2bms import bulk_hitobjects
+from om2bms import parse_cache
 
 
 class OsuBeatmapReader:
-    """Parses information from .osu file to OsuMania class. """
+    """
+    Parses information from .osu file to OsuMania class.
+
+    With cache, the parsed beatmap of a .osu file given by path is kept next to it and loaded instead of parsing
+    the file again while its content is the same, see om2bms.parse_cache
+    """
     _latest_tp_index = 0
     _latest_noninherited_tp_index = 0
     _sample_index = 1
 
-    def __init__(self, input_file):
-        self.osumania_beatmap = OsuMania()
-        self.parse(input_file, self.osumania_beatmap)
+    def __init__(self, input_file, cache: bool = False):
+        OsuBeatmapReader._latest_tp_index = 0
+        OsuBeatmapReader._latest_noninherited_tp_index = 0
+        OsuBeatmapReader._sample_index = 1
+        if not cache or hasattr(input_file, "readlines"):
+            self.osumania_beatmap = OsuMania()
+            self.parse(input_file, self.osumania_beatmap)
+            return
+        with open(input_file, "rb") as fp:
+            data = fp.read()
+        digest = parse_cache.content_hash(data)
+        self.osumania_beatmap = parse_cache.load(input_file, digest)
+        if self.osumania_beatmap is None:
+            self.osumania_beatmap = OsuMania()
+            self.parse(codecs.getreader("utf-8")(io.BytesIO(data)), self.osumania_beatmap)
+            parse_cache.save(input_file, digest, self.osumania_beatmap)
 
     def get_parsed_beatmap(self):
         """
@@ -30,7 +51,7 @@ class OsuBeatmapReader:
 
     def parse(self, input_file, osumania_beatmap):
         """
-        Parses beatmap
+        Parses beatmap. input_file is a path or an already opened text file object.
         """
         def header_hitobjects(line, beatmap):
             """
@@ -82,7 +103,7 @@ class OsuBeatmapReader:
             hit_object.hit_sound = int(line_separated[4])
             hit_object.time = int(line_separated[2])
 
-            if OsuBeatmapReader._latest_tp_index < len(beatmap.timing_points) - 1 and \
+            while OsuBeatmapReader._latest_tp_index < len(beatmap.timing_points) - 1 and \
                     beatmap.timing_points[OsuBeatmapReader._latest_tp_index + 1].time <= hit_object.time:
                 OsuBeatmapReader._latest_tp_index += 1
 
@@ -158,9 +179,6 @@ class OsuBeatmapReader:
                     del beatmap.timing_points[-1]
             else:
                 tp.ms_per_beat = float(line_separated[1])
-                bpm = calculate_bpm(tp)
-                if isinstance(bpm, float) or bpm > 255:
-                    beatmap.parse_float_bpm(bpm)
                 if len(beatmap.timing_points) > 0 and tp.time <= beatmap.noninherited_tp[-1].time + 1:
                     del beatmap.noninherited_tp[-1]
                 beatmap.noninherited_tp.append(tp)
@@ -329,8 +347,13 @@ class OsuBeatmapReader:
             """
             return line.split(symbol)
 
-        file = codecs.open(input_file, 'r', "utf-8")
+        if hasattr(input_file, "readlines"):
+            file = input_file
+        else:
+            file = codecs.open(input_file, 'r', "utf-8")
         section = "FileFormat"
+        bulk = bulk_hitobjects.available()
+        hitobject_lines = []
         for line in file.readlines():
             if is_empty(line) or is_comment(line):
                 continue
@@ -357,10 +380,27 @@ class OsuBeatmapReader:
             elif section == "Colours":
                 continue
             elif section == "HitObjects":
-                header_hitobjects(line, osumania_beatmap)
+                # parsed after the timing points are normalized
+                hitobject_lines.append(line)
             else:
                 OsuParseException("Header Error: " + section + " not found")
 
+        normalize_timing_points(osumania_beatmap)
+
+        if not bulk or len(hitobject_lines) < bulk_hitobjects.MIN_LINES:
+            for line in hitobject_lines:
+                header_hitobjects(line, osumania_beatmap)
+        elif len(hitobject_lines) > 0:
+            try:
+                if osumania_beatmap.key_count not in (7, 8):
+                    raise ValueError("Key count is not set")
+                OsuBeatmapReader._sample_index = bulk_hitobjects.parse_hitobjects(
+                    hitobject_lines, osumania_beatmap, OsuBeatmapReader._sample_index)
+            except ValueError:
+                # lines NumPy cannot read are parsed one by one, raising the usual errors
+                for line in hitobject_lines:
+                    header_hitobjects(line, osumania_beatmap)
+
         osumania_beatmap.objects = sorted(osumania_beatmap.hit_objects +
                                           osumania_beatmap.sample_objects +
                                           osumania_beatmap.noninherited_tp,
@@ -375,4 +415,5 @@ class OsuBeatmapReader:
         #         osumania_beatmap.objects[j], osumania_beatmap.objects[i], = \
         #             osumania_beatmap.objects[i], osumania_beatmap.objects[j]
 
-        file.close()
+        if file is not input_file:
+            file.close()
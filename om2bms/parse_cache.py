@@ -0,0 +1,77 @@
+"""
+Parsed beatmaps kept next to their .osu file, so converting a chart again skips the text parse
+"""
+import hashlib
+import io
+import os
+import pickle
+import struct
+import zlib
+
+from typing import Union
+
+from om2bms.data_structures import OsuMania
+
+
+# bump when OsuMania, the classes it holds or the parser change, so older caches are parsed again
+CACHE_VERSION = 1
+_MAGIC = b"OM2BMSPC"
+# magic, version, sha256 of the .osu file
+_HEADER = struct.Struct(">8sH32s")
+CACHE_SUFFIX = ".om2bmscache"
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    """
+    Only creates the classes of the parsed model, so a cache file can not run code when it is loaded
+    """
+    def find_class(self, module, name):
+        if module == "om2bms.data_structures" and name in ("OsuMania", "OsuTimingPoint", "OsuBGSoundEvent",
+                                                             "HitSound", "OsuManiaNote", "OsuManiaLongNote"):
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError("%s.%s is not part of a parsed beatmap" % (module, name))
+
+
+def cache_path(osu_path: str) -> str:
+    return osu_path + CACHE_SUFFIX
+
+
+def content_hash(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def load(osu_path: str, digest: bytes) -> Union[OsuMania, None]:
+    """
+    Returns the beatmap cached for the .osu at osu_path, or None if there is no cache, it was made by another
+    CACHE_VERSION or from another content than digest (content_hash of the .osu), or it can not be read
+    """
+    try:
+        with open(cache_path(osu_path), "rb") as fp:
+            data = fp.read()
+        (magic, version, cached_digest) = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != CACHE_VERSION or cached_digest != digest:
+            return None
+        beatmap = _ModelUnpickler(io.BytesIO(zlib.decompress(data[_HEADER.size:]))).load()
+    except Exception:
+        # a damaged cache raises about anything while unpickling, the .osu is parsed again
+        return None
+    return beatmap if isinstance(beatmap, OsuMania) else None
+
+
+def save(osu_path: str, digest: bytes, beatmap: OsuMania) -> None:
+    """
+    Caches beatmap, parsed from the .osu at osu_path with content_hash digest. The cache is written to a
+    temporary file and renamed, so a reader never sees a partial one. Does nothing if it can not be written.
+    """
+    path = cache_path(osu_path)
+    tmp_path = path + ".%d.tmp" % os.getpid()
+    try:
+        with open(tmp_path, "wb") as fp:
+            fp.write(_HEADER.pack(_MAGIC, CACHE_VERSION, digest))
+            fp.write(zlib.compress(pickle.dumps(beatmap, pickle.HIGHEST_PROTOCOL), 1))
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,151 @@
+"""
+Snaps measure offsets to the BMS grid
+"""
+from collections import OrderedDict
+from fractions import Fraction
+from functools import reduce
+from math import gcd
+from typing import Dict, List, Tuple
+
+
+def expand_fraction(n, ms_per_measure) -> Fraction:
+    """
+    Approximates n, where 0 < n < 1, to p/q where q=2^i or 3 * 2^i up to q=192.
+    A value that rounds up to a whole measure is returned as 0.
+    """
+    def expander(n, ms_per_measure, meter, end):
+        """
+        Generalized expander for non upper number of 3 or 4 measures.
+        """
+        def within_offset(num, sum__, offset):
+            """
+            return true if within
+            """
+            return int(ms_per_measure * num) - 1 < ms_per_measure * (sum__ + offset) < int(ms_per_measure * num) + 2
+        done = False
+        denominator = meter
+        sum_ = Fraction(1, meter)
+        while sum_ + Fraction(1, denominator) < n:
+            sum_ += Fraction(1, denominator)
+        iterations = 0
+        while iterations < 6:
+            if within_offset(n, sum_, 0) or round(n, 5) == round(float(sum_), 5):
+                done = True
+                break
+            if float(sum_) > n:
+                sum_ -= Fraction(1, denominator)
+                denominator *= 2
+            elif float(sum_) < n:
+                sum_ += Fraction(1, denominator)
+                denominator *= 2
+            iterations += 1
+        # pad with maxs. Each step moves sum_ by 1/end, so 2 * end steps cross the whole measure
+        steps = 0
+        while not done:
+            if steps == 2 * end:
+                # sum_ only oscillates around n from here on, take the grid point nearest to n
+                sum_ = Fraction(round(n * end), end)
+                break
+            steps += 1
+            if within_offset(n, sum_, 0):
+                break
+            prev_error = abs(n - sum_)
+            if sum_ > n:
+                if within_offset(n, sum_, -Fraction(1, end)):
+                    sum_ -= Fraction(1, end)
+                    break
+                elif abs(n - (prev_error - Fraction(1, end))) > sum_ - Fraction(1, end):
+                    break
+                sum_ -= Fraction(1, end)
+            elif sum_ < n:
+                if within_offset(n, sum_, Fraction(1, end)):
+                    sum_ += Fraction(1, end)
+                    break
+                elif abs(n - (prev_error + Fraction(1, end))) < sum_ - Fraction(1, end):
+                    break
+                sum_ += Fraction(1, end)
+        return (abs(n - sum_), sum_)
+
+    error2 = expander(n, ms_per_measure, 4, 128)
+    error3 = expander(n, ms_per_measure, 3, 192)
+    error = error2 if error2[0] < error3[0] else error3
+    if error[1] == 1:
+        return Fraction(0, 1)
+    return error[1]
+
+
+class QuantizationCache:
+    """
+    Bounded LRU cache of expand_fraction, keyed by (ms_per_measure, offset) where offset is the time from the
+    measure start in ms. The result depends on nothing else, so it holds for every measure of the same length,
+    in every difficulty converted by the process: the difficulties of a set usually share their timing, and a
+    batch worker converts many difficulties.
+
+    maxsize: number of entries kept. The least recently used entry is dropped past that.
+    """
+    def __init__(self, maxsize: int = 1 << 16):
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, offset: float, ms_per_measure: float) -> Fraction:
+        """
+        Returns expand_fraction(offset / ms_per_measure, ms_per_measure)
+        """
+        key = (ms_per_measure, offset)
+        value = self._values.get(key)
+        if value is not None:
+            self._values.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = expand_fraction(offset / ms_per_measure, ms_per_measure)
+        self._values[key] = value
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the size, hits, misses and evictions of the cache
+        """
+        return {"size": len(self._values), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# shared by every conversion of the process
+quantization_cache = QuantizationCache()
+
+
+def line_resolution(denominators: List[int]) -> int:
+    """
+    Smallest number of slots that places every fraction with one of denominators exactly
+    """
+    return reduce(lambda a, b: a * b // gcd(a, b), denominators, 1)
+
+
+def split_lines(positions: List[Fraction]) -> List[Tuple[int, List[int]]]:
+    """
+    Lays the positions of one channel in a measure out on data lines. Returns (resolution, indexes into
+    positions) for each line. Positions on the binary grid (q=2^i) and the triplet grid (q=3 * 2^i) go on
+    separate lines when the two lines together are shorter than a single line at their common resolution.
+    """
+    def line_length(resolution) -> int:
+        # "#XXXYY:" + 2 characters per slot + "\n"
+        return 8 + 2 * resolution
+
+    binary = [i for i in range(len(positions)) if positions[i].denominator % 3 != 0]
+    triplet = [i for i in range(len(positions)) if positions[i].denominator % 3 == 0]
+    resolution = line_resolution([e.denominator for e in positions])
+    if len(binary) == 0 or len(triplet) == 0:
+        return [(resolution, list(range(len(positions))))]
+    binary_resolution = line_resolution([positions[i].denominator for i in binary])
+    triplet_resolution = line_resolution([positions[i].denominator for i in triplet])
+    if line_length(binary_resolution) + line_length(triplet_resolution) < line_length(resolution):
+        return [(binary_resolution, binary), (triplet_resolution, triplet)]
+    return [(resolution, list(range(len(positions))))]
@@ -0,0 +1,93 @@
+"""
+Per-difficulty conversion results, written as JSON Lines
+"""
+import json
+import time
+import warnings
+
+from typing import Dict, List, Tuple, Union
+
+from om2bms.data_structures import OsuMania
+from om2bms.data_structures import count_notes
+from om2bms.exceptions import ConversionWarning
+from om2bms.exceptions import OsuGameTypeException
+from om2bms.om_to_bms import OsuManiaToBMSParser
+from om2bms.om_to_bmson import OsuManiaToBmsonParser
+
+
+def new_record(filename: str, osz: str = None) -> Dict:
+    """
+    Returns an empty "ok" record of filename, see convert_with_report
+    """
+    return {
+        "file": filename,
+        "osz": osz,
+        "status": "ok",
+        "error_class": None,
+        "error": None,
+        "notes": None,
+        "measures": None,
+        "wavs": None,
+        "outputs": [],
+        "output_bytes": 0,
+        "wall_ms": None,
+        "warnings": [],
+        "started": time.time()
+    }
+
+
+def convert_with_report(in_file, out_dir: str, filename: str, osz: str = None, output_format: str = "bms") \
+        -> Tuple[Union[OsuManiaToBMSParser, OsuManiaToBmsonParser, None], Dict]:
+    """
+    Converts in_file with OsuManiaToBMSParser, or OsuManiaToBmsonParser if output_format is "bmson", and returns
+    (parser, result record). parser is None if the conversion raised. Exceptions are recorded instead of raised.
+    Warnings raised during the conversion are recorded and printed.
+
+    The record has the keys file, osz, status ("ok", "skipped" for non o!m beatmaps, "failed"),
+    error_class, error, notes, measures, wavs, outputs, output_bytes, wall_ms, warnings and started.
+    """
+    record = new_record(filename, osz)
+    converted = None
+    error = None
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ConversionWarning)
+        try:
+            if output_format == "bmson":
+                converted = OsuManiaToBmsonParser(in_file, out_dir, filename)
+            else:
+                converted = OsuManiaToBMSParser(in_file, out_dir, filename)
+            error = converted.error
+        except Exception as e:
+            error = e
+    record["wall_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    for w in caught:
+        if issubclass(w.category, ConversionWarning):
+            print(w.message)
+            record["warnings"].append(str(w.message))
+        else:
+            warnings.showwarning(w.message, w.category, w.filename, w.lineno)
+
+    if error is not None:
+        record["status"] = "skipped" if isinstance(error, OsuGameTypeException) else "failed"
+        record["error_class"] = type(error).__name__
+        record["error"] = str(error)
+    beatmap = getattr(converted, "beatmap", None)
+    if isinstance(beatmap, OsuMania):
+        record["notes"] = count_notes(beatmap)
+        record["wavs"] = len(beatmap.hitsound_names)
+    if converted is not None and not converted.failed:
+        record["measures"] = converted.measure_count
+        record["outputs"] = list(converted.output_paths)
+        record["output_bytes"] = sum(len(data) for (_, data) in converted.output_data)
+    return converted, record
+
+
+def write_report(path: str, records: List[Dict]) -> None:
+    """
+    Appends records to the JSON Lines file at path, one record per line
+    """
+    with open(path, "a", encoding="utf-8") as fp:
+        for record in records:
+            fp.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,110 @@
+"""
+.osu files of a set handed to the worker processes in shared memory
+"""
+import itertools
+import os
+import threading
+
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List
+
+
+# names of the blocks, with the pid of the process creating them
+_BLOCK_PREFIX = "om2bms_"
+_block_numbers = itertools.count()
+# where Linux keeps the blocks as files
+_SHM_DIR = "/dev/shm"
+# held while a block is created or freed, see SharedCharts
+tracker_lock = threading.Lock()
+
+
+def remove_stale_blocks() -> None:
+    """
+    Removes the blocks left by processes that were killed together with their resource tracker. Only on Linux.
+    """
+    if not os.path.isdir(_SHM_DIR):
+        return
+    for f in os.listdir(_SHM_DIR):
+        if not f.startswith(_BLOCK_PREFIX):
+            continue
+        try:
+            pid = int(f[len(_BLOCK_PREFIX):].split("_")[0])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            try:
+                os.remove(os.path.join(_SHM_DIR, f))
+            except OSError:
+                pass
+        except OSError:
+            # alive, owned by another user
+            continue
+
+
+class SharedChart:
+    """
+    A .osu file in a SharedCharts block. OsuBeatmapReader reads it like an opened text file, straight from the
+    shared memory of the process it is sent to. Only the block name and the position of the file are pickled.
+
+    name: path of the .osu in the directory the set is extracted to. The BG of the chart is looked for next to it.
+    """
+    def __init__(self, block: str, offset: int, size: int, name: str):
+        self.block = block
+        self.offset = offset
+        self.size = size
+        self.name = name
+
+    def readlines(self) -> List[str]:
+        """
+        Returns the lines of the file, decoded and split like codecs.open(path, "r", "utf-8").readlines()
+        """
+        shm = SharedMemory(self.block)
+        try:
+            with shm.buf[self.offset:self.offset + self.size] as view:
+                return str(view, "utf-8").splitlines(True)
+        finally:
+            shm.close()
+
+
+class SharedCharts:
+    """
+    The .osu files of a set copied into one shared memory block, so the worker processes parse them without
+    reading the extracted files or receiving their bytes through a pipe.
+
+    Attaching to a block registers it with the resource tracker, which removes the blocks left when its
+    processes exit. The resource tracker must be running before the worker processes are started, so they
+    share the one of the process creating the blocks instead of starting their own, which would remove the
+    block as soon as a worker exits. Creating and freeing a block takes the lock of the resource tracker,
+    so workers must not be forked meanwhile, or they inherit it locked and hang on their first chart: pass
+    tracker_lock as the start_lock of the WorkerPool.
+
+    files: {filename: bytes of the .osu}
+    """
+    def __init__(self, files: Dict[str, bytes]):
+        # SharedMemory can not be empty
+        with tracker_lock:
+            self._shm = SharedMemory(_BLOCK_PREFIX + "%d_%d" % (os.getpid(), next(_block_numbers)), create=True,
+                                     size=max(1, sum(len(data) for data in files.values())))
+        # member table, {filename: (offset, size)}
+        self.table = {}
+        offset = 0
+        for (filename, data) in files.items():
+            self._shm.buf[offset:offset + len(data)] = data
+            self.table[filename] = (offset, len(data))
+            offset += len(data)
+
+    def chart(self, filename: str, path: str) -> SharedChart:
+        """
+        Returns the SharedChart of filename, to be sent to a worker. path is its path in the extracted set.
+        """
+        (offset, size) = self.table[filename]
+        return SharedChart(self._shm.name, offset, size, path)
+
+    def close(self) -> None:
+        """
+        Frees the block. The SharedCharts of the set can not be read after.
+        """
+        self._shm.close()
+        with tracker_lock:
+            self._shm.unlink()
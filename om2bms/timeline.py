@@ -0,0 +1,158 @@
+"""
+Measure timeline built from the uninherited timing points
+"""
+from bisect import bisect_right
+from typing import List, Tuple
+
+from om2bms.data_structures import OsuTimingPoint
+from om2bms.exceptions import OsuParseException
+from om2bms.quantize import quantization_cache
+
+
+class Measure:
+    """
+    A single measure of the main data field.
+
+    start_ms: time of the measure start
+    end_ms: objects earlier than end_ms (and later than the previous measure's end_ms) belong to the measure
+    truncation: length of the measure as a fraction of a full measure, 0 if not truncated
+    starts_with: timing point that the measure starts on, if any
+    started_by: first timing point that moved the measure start, differs from starts_with when several
+    timing points lie within 2 ms of each other
+    truncated_by: timing point that cuts the measure short, if any
+    """
+    def __init__(self, number: int, start_ms: float, timing_point: OsuTimingPoint):
+        self.number = number
+        self.start_ms = start_ms
+        self.timing_point = timing_point
+        self.ms_per_measure = timing_point.ms_per_beat * timing_point.meter
+        self.truncation = 0
+        self.starts_with = None
+        self.started_by = None
+        self.truncated_by = None
+
+    @property
+    def meter(self) -> int:
+        """
+        Upper number of the time signature
+        """
+        return self.timing_point.meter
+
+    @property
+    def end_ms(self) -> float:
+        """
+        Objects before end_ms are placed in this measure
+        """
+        if self.truncated_by is not None:
+            return self.truncated_by.time
+        return int(self.start_ms + self.ms_per_measure) - 1
+
+    def __repr__(self):
+        return str(self.number).zfill(3) + " at " + str(self.start_ms) + "ms"
+
+
+class MeasureTimeline:
+    """
+    Every measure from starting_measure on, with BPM changes and truncated measures worked out from
+    noninherited_tp. Measures after the last timing point are added as they are looked up.
+
+    A timing point within 2 ms of a measure start moves the measure start onto it. Any other timing point
+    truncates the measure it falls in and starts a new measure. Timing points with a beat length of 0 or less
+    are rejected, measures would never end.
+    """
+    _cache = {}
+    _cache_size = 8
+
+    def __init__(self, noninherited_tp: List[OsuTimingPoint], starting_measure: int, starting_ms: float):
+        for tp in noninherited_tp:
+            if tp.ms_per_beat * tp.meter <= 0:
+                raise OsuParseException("Timing point at %s ms has a measure length of %s ms"
+                                        % (tp.time, tp.ms_per_beat * tp.meter))
+        self.measures = [Measure(starting_measure, starting_ms, noninherited_tp[0])]
+        self._ends = []
+        for tp in noninherited_tp:
+            self._add_timing_point(tp)
+
+    @classmethod
+    def get(cls, noninherited_tp: List[OsuTimingPoint], starting_measure: int,
+            starting_ms: float) -> "MeasureTimeline":
+        """
+        Returns the timeline for the timing points, reusing the timeline built for a previous difficulty
+        with the same timing.
+        """
+        key = (starting_measure, starting_ms,
+               tuple((tp.time, tp.ms_per_beat, tp.meter) for tp in noninherited_tp))
+        if key not in cls._cache:
+            if len(cls._cache) >= cls._cache_size:
+                del cls._cache[next(iter(cls._cache))]
+            cls._cache[key] = MeasureTimeline(noninherited_tp, starting_measure, starting_ms)
+        return cls._cache[key]
+
+    def _extend(self):
+        """
+        Adds the measure following the last measure
+        """
+        last = self.measures[-1]
+        self._ends.append(last.end_ms)
+        self.measures.append(Measure(last.number + 1, last.start_ms + last.ms_per_measure, last.timing_point))
+
+    def _add_timing_point(self, tp: OsuTimingPoint):
+        """
+        Moves or truncates the measure that tp falls in
+        """
+        while tp.time >= self.measures[-1].end_ms:
+            self._extend()
+        current = self.measures[-1]
+        if within_2_ms(current.start_ms, tp.time):
+            current.start_ms = tp.time
+            current.timing_point = tp
+            current.ms_per_measure = tp.ms_per_beat * tp.meter
+            current.starts_with = tp
+            if current.started_by is None:
+                current.started_by = tp
+        else:
+            if tp.time - current.start_ms < 0:
+                truncation_ms = tp.time - (current.start_ms - current.ms_per_measure)
+            else:
+                truncation_ms = tp.time - current.start_ms
+            current.truncation = quantization_cache.get(truncation_ms, current.ms_per_measure)
+            current.truncated_by = tp
+            self._ends.append(current.end_ms)
+            measure = Measure(current.number + 1, tp.time, tp)
+            measure.starts_with = tp
+            measure.started_by = tp
+            self.measures.append(measure)
+
+    def index_of(self, time) -> int:
+        """
+        Returns the index in measures of the measure an object at time belongs to
+        """
+        while time >= self.measures[-1].end_ms:
+            self._extend()
+        return bisect_right(self._ends, time)
+
+    def assign(self, objects) -> List[Tuple[Measure, list]]:
+        """
+        Groups objects that are not timing points by measure. Returns (measure, objects) for every measure
+        from the first measure to the measure of the last object or timing point.
+        """
+        groups = []
+        for obj in objects:
+            if isinstance(obj, OsuTimingPoint):
+                continue
+            index = self.index_of(obj.time)
+            while len(groups) <= index:
+                groups.append([])
+            groups[index].append(obj)
+        last = max(len(groups), max((i + 1 for i, m in enumerate(self.measures) if m.starts_with is not None),
+                                    default=0))
+        while len(groups) < last:
+            groups.append([])
+        return [(self.measures[i], groups[i]) for i in range(last)]
+
+
+def within_2_ms(base, n) -> bool:
+    """
+    True if n is close enough to base
+    """
+    return base - 2 <= n <= base + 2
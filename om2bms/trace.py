@@ -0,0 +1,94 @@
+"""
+Traces of conversion runs in the Trace Event Format, viewable in Perfetto or chrome://tracing
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+# spans recorded in this process, None while tracing is off
+_events = None
+# (pid, tid): thread name of the threads that recorded spans
+_threads = {}
+
+
+def enable() -> None:
+    """
+    Starts recording spans in this process
+    """
+    global _events
+    if _events is None:
+        _events = []
+
+
+def enabled() -> bool:
+    return _events is not None
+
+
+def clock() -> float:
+    """
+    Returns the current time in microseconds. perf_counter is system-wide, so times of different processes can
+    be compared.
+    """
+    return time.perf_counter() * 1000000
+
+
+def add_span(name: str, start: float, **args) -> None:
+    """
+    Records a span from start, a clock() value, until now on the current thread
+    """
+    if _events is None:
+        return
+    pid = os.getpid()
+    thread = threading.current_thread()
+    tid = thread.ident
+    if (pid, tid) not in _threads:
+        _threads[(pid, tid)] = multiprocessing.current_process().name + "/" + thread.name
+    _events.append({"name": name, "cat": "om2bms", "ph": "X", "ts": round(start, 1),
+                    "dur": round(clock() - start, 1), "pid": pid, "tid": tid, "args": args})
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Records the time spent in the with block as a span
+    """
+    start = clock()
+    try:
+        yield
+    finally:
+        add_span(name, start, **args)
+
+
+def collect() -> List[Dict]:
+    """
+    Returns the spans recorded in this process since the last call, with the names of their threads
+    """
+    global _events
+    if _events is None:
+        return []
+    (events, _events) = (_events, [])
+    names = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+             for ((pid, tid), name) in _threads.items()]
+    return names + events
+
+
+def write_trace(path: str, events: List[Dict]) -> None:
+    """
+    Writes events to path as a JSON trace. Thread names recorded more than once are kept once.
+    """
+    seen = set()
+    trace_events = []
+    for event in events:
+        if event["ph"] == "M":
+            if (event["pid"], event["tid"]) in seen:
+                continue
+            seen.add((event["pid"], event["tid"]))
+        trace_events.append(event)
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fp, ensure_ascii=False)
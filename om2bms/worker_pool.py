@@ -0,0 +1,215 @@
+"""
+Process pool that kills workers stuck on a task
+"""
+import collections
+import multiprocessing
+import threading
+import time
+
+from multiprocessing.connection import wait
+from typing import Any, Callable, Tuple
+
+from om2bms.exceptions import ConversionTimeoutException
+from om2bms.exceptions import WorkerCrashedException
+
+
+def _worker_main(conn, initializer: Callable, initargs: Tuple) -> None:
+    """
+    Runs the tasks received on conn until it receives None
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        (func, args) = task
+        try:
+            result = (True, func(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # the result or the exception can not be pickled
+            conn.send((False, RuntimeError(type(e).__name__ + ": " + str(e))))
+
+
+class Task:
+    """
+    A function call submitted to a WorkerPool. get() waits for its result.
+    """
+    def __init__(self, func: Callable, args: Tuple):
+        self.func = func
+        self.args = args
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def _finish(self, value: Any = None, error: Exception = None) -> None:
+        self._value = value
+        self._error = error
+        self._done.set()
+
+    def get(self) -> Any:
+        """
+        Returns the result of the call, or raises its exception. Raises ConversionTimeoutException if the call
+        took longer than the time budget and WorkerCrashedException if its worker died.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class _Worker:
+    def __init__(self, initializer: Callable, initargs: Tuple, start_lock: threading.Lock):
+        (self.conn, child_conn) = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn, initializer, initargs),
+                                               daemon=True)
+        with start_lock:
+            self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+
+
+class WorkerPool:
+    """
+    Pool of worker processes running tasks in the order they are submitted, like
+    multiprocessing.Pool.apply_async.
+
+    multiprocessing.Pool can not stop a task, so a chart that makes the converter loop forever holds its worker
+    and the whole batch, and a worker killed from outside leaves its task waiting forever. Here a dispatcher
+    thread hands each task to an idle worker over its own pipe and kills the worker once the task has run for
+    time_budget seconds. The task fails with ConversionTimeoutException, or
+    WorkerCrashedException if the worker died on its own, and a new worker takes the place of the old one.
+
+    workers: number of worker processes
+    initializer: called with initargs in every worker process, including the replacements
+    time_budget: seconds a task may run. None for no limit.
+    start_lock: held while a worker process is started. A forked worker inherits the locks other threads of
+    the caller hold at that moment, locked, so they can hold start_lock around work that takes a lock the
+    workers need too.
+    """
+    def __init__(self, workers: int, initializer: Callable = None, initargs: Tuple = (),
+                 time_budget: float = None, start_lock: threading.Lock = None):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.time_budget = time_budget
+        self.start_lock = start_lock or threading.Lock()
+        self._workers = [_Worker(initializer, initargs, self.start_lock) for _ in range(workers)]
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        # wakes the dispatcher up on submit() and close()
+        (self._wakeup_r, self._wakeup_w) = multiprocessing.Pipe(duplex=False)
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, func: Callable, args: Tuple = ()) -> Task:
+        """
+        Queues func(*args). Returns its Task.
+        """
+        task = Task(func, args)
+        with self._lock:
+            self._pending.append(task)
+        self._wakeup_w.send(None)
+        return task
+
+    def close(self) -> None:
+        """
+        Waits until every submitted task is finished and stops the workers
+        """
+        with self._lock:
+            self._closed = True
+        self._wakeup_w.send(None)
+        self._dispatcher.join()
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                # already dead
+                pass
+            worker.process.join()
+
+    def terminate(self) -> None:
+        """
+        Kills the workers. Unfinished tasks are left unfinished.
+        """
+        for worker in self._workers:
+            worker.process.terminate()
+            worker.process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def _replace(self, worker: _Worker, error: Exception) -> None:
+        """
+        Fails the task of worker with error and starts a new worker in its place
+        """
+        worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        worker.task._finish(error=error)
+        self._workers[self._workers.index(worker)] = _Worker(self.initializer, self.initargs, self.start_lock)
+
+    def _dispatch(self) -> None:
+        """
+        Dispatcher thread
+        """
+        while True:
+            with self._lock:
+                for worker in self._workers:
+                    if worker.task is None and len(self._pending) > 0:
+                        worker.task = self._pending.popleft()
+                        worker.started = time.perf_counter()
+                        try:
+                            worker.conn.send((worker.task.func, worker.task.args))
+                        except (EOFError, OSError):
+                            # the worker died while it was idle
+                            worker.process.join()
+                            self._replace(worker, WorkerCrashedException(
+                                "worker exited with code %s" % worker.process.exitcode))
+                        except Exception as e:
+                            # the task can not be pickled, nothing was sent
+                            (task, worker.task) = (worker.task, None)
+                            task._finish(error=e)
+                busy = [worker for worker in self._workers if worker.task is not None]
+                if self._closed and len(busy) == 0 and len(self._pending) == 0:
+                    return
+                if len(self._pending) > 0 and len(busy) < len(self._workers):
+                    # a task failed to be sent, hand the next one to its worker
+                    continue
+
+            timeout = None
+            if self.time_budget is not None and len(busy) > 0:
+                deadline = min(worker.started for worker in busy) + self.time_budget
+                timeout = max(0, deadline - time.perf_counter())
+            ready = wait([worker.conn for worker in busy] + [self._wakeup_r], timeout)
+            if self._wakeup_r in ready:
+                while self._wakeup_r.poll():
+                    self._wakeup_r.recv()
+
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        (ok, value) = worker.conn.recv()
+                    except (EOFError, OSError):
+                        worker.process.join()
+                        self._replace(worker, WorkerCrashedException(
+                            "worker exited with code %s" % worker.process.exitcode))
+                        continue
+                    task = worker.task
+                    worker.task = None
+                    task._finish(value if ok else None, None if ok else value)
+                elif self.time_budget is not None and \
+                        time.perf_counter() - worker.started >= self.time_budget:
+                    self._replace(worker, ConversionTimeoutException(
+                        "no result after %g s, the worker was killed" % self.time_budget))
@@ -0,0 +1,210 @@
+import os
+import zipfile
+
+from argparse import ArgumentParser
+
+from om2bms.batch import BatchConverter
+from om2bms.batch import estimate_set_cost
+from om2bms.image_resizer import IMAGE_SIZES
+from om2bms.report import write_report
+
+
+def record_results(index_path, records_) -> None:
+    """
+    Stores conversion result records in the library index at index_path. The hashes of the converted charts are
+    read from their .osz again.
+    """
+    from om2bms.library import LibraryIndex
+    from om2bms.library import file_hash
+
+    index = LibraryIndex(index_path)
+    by_osz = {}
+    for record in records_:
+        # sets that could not be read have no difficulty
+        if record["file"] is not None:
+            by_osz.setdefault(record["osz"], []).append(record)
+    for (osz_path, osz_records) in by_osz.items():
+        try:
+            with zipfile.ZipFile(osz_path, "r") as zipf:
+                hashes = {record["file"]: file_hash(zipf.read(record["file"])) for record in osz_records}
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print("Not recorded in the index: " + osz_path + ": " + str(e))
+            continue
+        for record in osz_records:
+            output_path = record["outputs"][0] if len(record["outputs"]) > 0 else None
+            index.record_conversion(osz_path, record["file"], hashes[record["file"]], output_path,
+                                    record["measures"], record["status"], record["error"])
+    index.close()
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description='Convert every .osz in a directory to BMS files. The next sets are '
+                                        'extracted while the current ones are converted and written.',
+                            add_help=True,
+                            allow_abbrev=True)
+
+    parser.add_argument('-i', '--in_dir',
+                        action='store',
+                        help='Directory of .osz files to convert. Not needed with -p.',
+                        type=str)
+
+    parser.add_argument('-ix', '--index',
+                        action='store',
+                        default='None',
+                        help='Path to a library index database to record conversion results in. '
+                             'See om2bms_index.py',
+                        type=str)
+
+    parser.add_argument('-p', '--pending',
+                        action='store_true',
+                        default=False,
+                        help='Converts the .osz files the index (-ix) lists as not converted yet or changed since, '
+                             'instead of the ones in -i.')
+
+    parser.add_argument('-k', '--keys',
+                        default=None,
+                        type=int,
+                        help="With -p, only converts the sets with a pending chart of this key count.")
+
+    parser.add_argument('-od', '--out_dir',
+                        action='store',
+                        default='None',
+                        help='Output directory. Each set is written to a folder named after its .osz. '
+                             'Defaults to the directory in default_outdir.ini, see om2bms_osz.py',
+                        type=str)
+
+    parser.add_argument('-hs', '--hitsound',
+                        action='store_false',
+                        default=True,
+                        help='Disables hitsounds.')
+
+    parser.add_argument('-b', '--bg',
+                        action='store_false',
+                        default=True,
+                        help='Disables background image conversion.')
+
+    parser.add_argument('-img', '--images',
+                        nargs='+',
+                        default=list(IMAGE_SIZES),
+                        choices=list(IMAGE_SIZES),
+                        help="Images made from the BG, letterboxed to the size of their header command: "
+                             "BMP01 256x256, STAGEFILE 640x480, BANNER 300x80, BACKBMP 640x480. Defaults to all.")
+
+    parser.add_argument('-o', '--offset',
+                        default=0,
+                        type=int,
+                        help="Adjusts music start time by [offset] ms.")
+
+    parser.add_argument('-j', '--judge',
+                        default=3,
+                        type=int,
+                        help="Judge difficulty. Defaults to EASY. "
+                        "(3: EASY), (2: NORMAL), (1: HARD), (0: VERY HARD)")
+
+    parser.add_argument('-fmt', '--format',
+                        default='bms',
+                        choices=['bms', 'bmson'],
+                        help="Output format. bmson places notes on exact pulses instead of the BMS grid.")
+
+    parser.add_argument('-res', '--resolution',
+                        default=960,
+                        type=int,
+                        help="Pulses per beat of bmson output. Defaults to 960.")
+
+    parser.add_argument('-sp', '--split',
+                        action='store_true',
+                        default=False,
+                        help="Splits charts longer than 999 measures into several parts instead of failing.")
+
+    parser.add_argument('-w', '--workers',
+                        default=None,
+                        type=int,
+                        help="Number of conversion processes. Defaults to the number of CPUs.")
+
+    parser.add_argument('-tb', '--time_budget',
+                        default=None,
+                        type=float,
+                        help="Seconds a difficulty may take to convert. Its worker is killed after that and "
+                             "the difficulty is recorded as failed. No limit by default.")
+
+    parser.add_argument('-pf', '--prefetch',
+                        default=2,
+                        type=int,
+                        help="Number of sets extracted ahead of the conversion, and of converted sets waiting "
+                             "to be written. Bounds memory and temporary disk use. Defaults to 2.")
+
+    parser.add_argument('-wr', '--writers',
+                        default=4,
+                        type=int,
+                        help="Number of files written at the same time. Raise it for output directories on a "
+                             "network share. Defaults to 4.")
+
+    parser.add_argument('-jn', '--journal',
+                        action='store',
+                        default='None',
+                        help='Journal of finished sets and difficulties. Running the batch again with the same '
+                             'journal skips finished work and cleans up after a crashed run.',
+                        type=str)
+
+    parser.add_argument('-tr', '--trace',
+                        action='store',
+                        default='None',
+                        help='Writes a trace of the run to this JSON file, with the unzip, parse, quantize/emit, '
+                             'write, BG resize and asset copy spans of every thread and worker process. Open it '
+                             'in Perfetto (ui.perfetto.dev) or chrome://tracing.',
+                        type=str)
+
+    parser.add_argument('-jl', '--jsonl',
+                        action='store',
+                        default='None',
+                        help='Appends a JSON record per difficulty to this JSON Lines file.',
+                        type=str)
+
+    args = parser.parse_args()
+    if args.pending and args.index == "None":
+        parser.error("-p needs -ix")
+    if not args.pending and args.in_dir is None:
+        parser.error("one of -i and -p is required")
+
+    outdir = args.out_dir
+    if outdir == "None":
+        cfg_file = os.path.join(os.getcwd(), 'default_outdir.ini')
+        outdir = ""
+        if os.path.exists(cfg_file):
+            with open(cfg_file, "r") as cfg_fp:
+                outdir = cfg_fp.readline().strip()
+        if outdir == "":
+            outdir = os.getcwd()
+
+    if args.pending:
+        from om2bms.library import LibraryIndex
+        index = LibraryIndex(args.index)
+        # loose .osu files are left to om2bms.py
+        osz_paths = [path for path in index.pending_sets(args.keys) if path.lower().endswith(".osz")]
+        index.close()
+    else:
+        osz_paths = sorted(os.path.join(args.in_dir, f) for f in os.listdir(args.in_dir) if f.endswith(".osz"))
+    # largest sets first, so the batch does not end on one of them
+    osz_paths.sort(key=estimate_set_cost, reverse=True)
+    options = {
+        "HITSOUND": args.hitsound,
+        "BG": args.bg,
+        "OFFSET": args.offset,
+        "JUDGE": args.judge,
+        "SPLIT": args.split,
+        "RESOLUTION": args.resolution,
+        "IMAGES": args.images
+    }
+    converter = BatchConverter(outdir, options, args.format, args.workers, args.prefetch,
+                               journal_path=None if args.journal == "None" else args.journal,
+                               time_budget=args.time_budget, writers=args.writers,
+                               trace_path=None if args.trace == "None" else args.trace)
+    records = converter.run(osz_paths)
+    if args.index != "None":
+        record_results(args.index, records)
+    if args.jsonl != "None":
+        write_report(args.jsonl, records)
+    failed = sum(record["status"] == "failed" for record in records)
+    print("Done: %d sets, %d difficulties, %d failed" % (len(osz_paths), len(records), failed))
+    exit(0)
@@ -0,0 +1,44 @@
+from argparse import ArgumentParser
+
+from om2bms.library import LibraryIndex
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description='Maintain a SQLite index of .osz/.osu files and their conversion status',
+                            add_help=True,
+                            allow_abbrev=True)
+
+    parser.add_argument('-db', '--database',
+                        action='store',
+                        default='library.db',
+                        help='Path to the index database. Defaults to library.db',
+                        type=str)
+
+    parser.add_argument('-s', '--scan',
+                        action='store',
+                        default='None',
+                        help='Directory to scan for .osz/.osu files. Unchanged files are skipped.',
+                        type=str)
+
+    parser.add_argument('-p', '--pending',
+                        action='store_true',
+                        default=False,
+                        help='Prints the paths of sets that were not converted yet or changed since.')
+
+    parser.add_argument('-k', '--keys',
+                        default=None,
+                        type=int,
+                        help="Only list charts with this key count.")
+
+    args = parser.parse_args()
+
+    index = LibraryIndex(args.database)
+    if args.scan != "None":
+        parsed, removed = index.scan(args.scan)
+        print("Indexed %d charts, removed %d" % (parsed, removed))
+    if args.pending:
+        for path in index.pending_sets(args.keys):
+            print(path)
+    index.close()
+    exit(0)
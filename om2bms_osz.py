@@ -3,40 +3,98 @@ import os
 import shutil
 
 from argparse import ArgumentParser
-from om2bms.exceptions import BMSMaxMeasuresException
-from om2bms.image_resizer import black_background_thumbnail
+from om2bms.image_resizer import IMAGE_SIZES
+from om2bms.report import convert_with_report
+from om2bms.report import write_report
 
 import om2bms.om_to_bms
-import multiprocessing
 
 
-def start_convertion(filedir_, output_file_dir_, file_, args, bg_list_):
+def start_convertion(filedir_, output_file_dir_, file_, osz_path_, args):
     """
-    Returns bg filename
+    Converts one difficulty. Returns (bg filename, result record, output data), see
+    om2bms.report.convert_with_report. Output data is the [(path, bytes)] of the converted files when they are
+    written to an archive instead of output_file_dir_, otherwise None.
     """
-    try:
-        om2bms.om_to_bms.OsuManiaToBMSParser._convertion_options = {
-            "HITSOUND": args.hitsound,
-            "BG": args.bg,
-            "OFFSET": args.offset,
-            "JUDGE": args.judge
-        }
-        
-        converted_file = om2bms.om_to_bms.OsuManiaToBMSParser(filedir_, output_file_dir_, file_)
-        if not converted_file.failed and args.bg:
-            bg_list_.append(converted_file.get_bg())
-    except BMSMaxMeasuresException as e:
-        print(e)
+    om2bms.om_to_bms.OsuManiaToBMSParser._convertion_options = {
+        "HITSOUND": args.hitsound,
+        "BG": args.bg,
+        "OFFSET": args.offset,
+        "JUDGE": args.judge,
+        "SPLIT": args.split,
+        "RESOLUTION": args.resolution,
+        "IMAGES": args.images,
+        "WRITE_FILES": args.archive is None
+    }
+
+    converted_file, record = convert_with_report(filedir_, output_file_dir_, file_, osz_path_, args.format)
+    if converted_file is None:
+        # errors the parser does not handle itself; the other difficulties of the set keep going
+        print(record["error"])
+        return None, record, None
+    bg = converted_file.get_bg() if args.bg and not converted_file.failed else None
+    output_data = converted_file.output_data if args.archive is not None else None
+    return bg, record, output_data
+
+
+def convert_all(jobs, args) -> list:
+    """
+    Calls start_convertion on every (filedir, output_file_dir, file, osz path) in jobs and returns the results
+    in order.
+    Several difficulties, or any difficulty with a time budget, are converted in a pool of processes, a single
+    one without a time budget in this process. A difficulty that takes longer than args.time_budget seconds or
+    whose process dies is recorded as failed.
+    """
+    if len(jobs) <= 1 and args.time_budget is None:
+        return [start_convertion(*job, args) for job in jobs]
+    from om2bms.exceptions import ConversionTimeoutException
+    from om2bms.exceptions import WorkerCrashedException
+    from om2bms.report import new_record
+    from om2bms.worker_pool import WorkerPool
+
+    results = []
+    with WorkerPool(max(1, min(len(jobs), os.cpu_count() or 1)), time_budget=args.time_budget) as pool:
+        tasks = [pool.submit(start_convertion, job + (args,)) for job in jobs]
+        for (job, task) in zip(jobs, tasks):
+            try:
+                results.append(task.get())
+            except (ConversionTimeoutException, WorkerCrashedException) as e:
+                print(job[2] + ": " + str(e))
+                record = new_record(job[2], job[3])
+                record.update(status="failed", error_class=type(e).__name__, error=str(e))
+                results.append((None, record, None))
+    return results
+
+
+def record_results(index_path, osz_path, unzip_dir_, records_) -> None:
+    """
+    Stores conversion result records in the library index at index_path
+    """
+    from om2bms.library import LibraryIndex
+    from om2bms.library import file_hash
+
+    index = LibraryIndex(index_path)
+    for record in records_:
+        with open(os.path.join(unzip_dir_, record["file"]), "rb") as fp:
+            sha1 = file_hash(fp.read())
+        output_path = record["outputs"][0] if len(record["outputs"]) > 0 else None
+        index.record_conversion(osz_path, record["file"], sha1, output_path, record["measures"],
+                                record["status"], record["error"])
+    index.close()
 
 
-def convert_bg_list(bg_list_) -> None:
+def convert_bg_list(bg_list_, images) -> None:
     """
-    Converts all images in img_list
+    Makes the images of the header commands in images from all BGs in bg_list_
     """
+    if all(bg is None for bg in bg_list_):
+        return
+    from om2bms.image_resizer import letterbox_images
+
     seen = []
     for bg in bg_list_:
         if bg is not None and bg not in seen:
-            black_background_thumbnail(bg)
+            letterbox_images(bg, images)
             seen.append(bg)
 
 
@@ -68,6 +126,13 @@ if __name__ == "__main__":
                         default=True,
                         help='Disables background image conversion.')
 
+    parser.add_argument('-img', '--images',
+                        nargs='+',
+                        default=list(IMAGE_SIZES),
+                        choices=list(IMAGE_SIZES),
+                        help="Images made from the BG, letterboxed to the size of their header command: "
+                             "BMP01 256x256, STAGEFILE 640x480, BANNER 300x80, BACKBMP 640x480. Defaults to all.")
+
     parser.add_argument('-f', '--foldername',
                         action='store',
                         default='None',
@@ -85,7 +150,58 @@ if __name__ == "__main__":
                         help="Judge difficulty. Defaults to EASY. "
                         "(3: EASY), (2: NORMAL), (1: HARD), (0: VERY HARD)")
 
+    parser.add_argument('-fmt', '--format',
+                        default='bms',
+                        choices=['bms', 'bmson'],
+                        help="Output format. bmson places notes on exact pulses instead of the BMS grid.")
+
+    parser.add_argument('-res', '--resolution',
+                        default=960,
+                        type=int,
+                        help="Pulses per beat of bmson output. Defaults to 960.")
+
+    parser.add_argument('-sp', '--split',
+                        action='store_true',
+                        default=False,
+                        help="Splits charts longer than 999 measures into several parts instead of failing. "
+                             "Parts after the first do not play the audio file.")
+
+    parser.add_argument('-ar', '--archive',
+                        default=None,
+                        choices=['zip', 'tar'],
+                        help="Writes the converted files and assets into [OUTPUT DIRECTORY]/[foldername].zip or "
+                             ".tar instead of a directory. Audio is stored uncompressed.")
+
+    parser.add_argument('-as', '--asset_store',
+                        action='store',
+                        default='None',
+                        help='Path to an asset store shared by all converted sets. Assets are hardlinked from it '
+                             'instead of copied, one copy per unique file. See om2bms_store.py',
+                        type=str)
+
+    parser.add_argument('-tb', '--time_budget',
+                        default=None,
+                        type=float,
+                        help="Seconds a difficulty may take to convert. Its process is killed after that and "
+                             "the difficulty is recorded as failed. No limit by default.")
+
+    parser.add_argument('-ix', '--index',
+                        action='store',
+                        default='None',
+                        help='Path to a library index database to record conversion results in. '
+                             'See om2bms_index.py',
+                        type=str)
+
+    parser.add_argument('-jl', '--jsonl',
+                        action='store',
+                        default='None',
+                        help='Appends a JSON record per difficulty (status, error, note, measure and WAV counts, '
+                             'output size, wall time, warnings) to this JSON Lines file.',
+                        type=str)
+
     args = parser.parse_args()
+    if args.archive is not None and args.asset_store != "None":
+        parser.error("-ar and -as cannot be used together")
     cwd = os.getcwd()
 
     cfg_file = os.path.join(cwd, 'default_outdir.ini')
@@ -116,6 +232,9 @@ if __name__ == "__main__":
         out_foldername = args.foldername
         
     unzip_dir = os.path.join(cwd, "unzip_dir")
+    if os.path.isdir(unzip_dir):
+        # left behind by a run that was killed
+        shutil.rmtree(unzip_dir)
     if not os.path.isdir(unzip_dir):
         os.makedirs(unzip_dir)
     try:
@@ -136,10 +255,19 @@ if __name__ == "__main__":
             zipf.extractall(unzip_dir)
 
         output_file_dir = os.path.join(outdir, out_foldername)
-        print("Output directory is " + output_file_dir)
-
-        if not os.path.isdir(output_file_dir):
-            os.makedirs(output_file_dir)
+        archive = None
+        if args.archive is not None:
+            # converted files are kept in memory and only named after output_file_dir
+            from om2bms.archive import SetArchive
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+            archive = SetArchive(output_file_dir + "." + args.archive, out_foldername, args.archive)
+            print("Output archive is " + archive.path)
+        else:
+            print("Output directory is " + output_file_dir)
+
+            if not os.path.isdir(output_file_dir):
+                os.makedirs(output_file_dir)
 
         # convert beatmap
         # bg_list = []
@@ -152,21 +280,23 @@ if __name__ == "__main__":
         #         except BMSMaxMeasuresException as e:
         #             print(e)
         #             continue
-        processes = []
-        manager = multiprocessing.Manager()
-        bg_list = manager.list()
+        jobs = []
         for file in os.listdir(unzip_dir):
             if file.endswith(".osu"):
                 filedir = os.path.join(unzip_dir, file)
-                p = multiprocessing.Process(target=start_convertion,
-                                            args=(filedir, output_file_dir, file, args, bg_list))
-                processes.append(p)
-
-        for p in processes:
-            p.start()
-
-        for p in processes:
-            p.join()
+                jobs.append((filedir, output_file_dir, file, os.path.abspath(args.in_file)))
+        converted = convert_all(jobs, args)
+        bg_list = [bg for (bg, _, _) in converted]
+        records = [record for (_, record, _) in converted]
+        if archive is not None:
+            for (_, _, output_data) in converted:
+                for (path, data) in output_data or []:
+                    archive.write(path, data)
+
+        if args.index != "None":
+            record_results(args.index, os.path.abspath(args.in_file), unzip_dir, records)
+        if args.jsonl != "None":
+            write_report(args.jsonl, records)
 
         # convert bg
         # if args.hitsound:
@@ -177,18 +307,29 @@ if __name__ == "__main__":
         #             seen.append(bg)
         if args.bg:
             print("Converting BG...")
-            convert_bg_list(bg_list)
+            convert_bg_list(bg_list, args.images)
 
         # move files to output directory
+        store = None
+        if args.asset_store != "None":
+            from om2bms.asset_store import AssetStore
+            store = AssetStore(args.asset_store)
         for f in os.listdir(unzip_dir):
             if not os.path.isdir(os.path.join(unzip_dir, f)):
                 if not f.split(".")[-1] == "zip" and not f.split(".")[-1] == "osu":
                     full_path = os.path.join(unzip_dir, f)
                     try:
-                        shutil.copy2(full_path, output_file_dir)
+                        if archive is not None:
+                            archive.add_file(full_path)
+                        elif store is not None:
+                            store.link(full_path, output_file_dir)
+                        else:
+                            shutil.copy2(full_path, output_file_dir)
                     except PermissionError as e:
                         print(e)
                         continue
+        if archive is not None:
+            archive.close()
 
         print("Done")
         exit(0)
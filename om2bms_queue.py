@@ -0,0 +1,157 @@
+import os
+import time
+
+from argparse import ArgumentParser
+
+from om2bms.batch import estimate_set_cost
+from om2bms.image_resizer import IMAGE_SIZES
+from om2bms.job_queue import JobQueue
+from om2bms.job_queue import run_worker
+from om2bms.report import write_report
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description='Convert a directory of .osz files on several machines through a job queue '
+                                        'in a shared directory. Run once with -s to submit the sets and wait for '
+                                        'the results, and with -wk on every machine that should convert.',
+                            add_help=True,
+                            allow_abbrev=True)
+
+    parser.add_argument('-q', '--queue',
+                        action='store',
+                        help='Queue directory, shared by the coordinator and all workers.',
+                        type=str)
+
+    parser.add_argument('-s', '--submit',
+                        action='store',
+                        default='None',
+                        help='Coordinator: directory of .osz files to submit. Waits until every job is done, '
+                             'retrying the jobs of workers that died.',
+                        type=str)
+
+    parser.add_argument('-wk', '--work',
+                        action='store_true',
+                        default=False,
+                        help='Worker: converts jobs until the queue is empty.')
+
+    parser.add_argument('-od', '--out_dir',
+                        action='store',
+                        default='None',
+                        help='Output directory of the submitted sets, as seen by the workers.',
+                        type=str)
+
+    parser.add_argument('-hs', '--hitsound',
+                        action='store_false',
+                        default=True,
+                        help='Disables hitsounds.')
+
+    parser.add_argument('-b', '--bg',
+                        action='store_false',
+                        default=True,
+                        help='Disables background image conversion.')
+
+    parser.add_argument('-img', '--images',
+                        nargs='+',
+                        default=list(IMAGE_SIZES),
+                        choices=list(IMAGE_SIZES),
+                        help="Images made from the BG, letterboxed to the size of their header command: "
+                             "BMP01 256x256, STAGEFILE 640x480, BANNER 300x80, BACKBMP 640x480. Defaults to all.")
+
+    parser.add_argument('-o', '--offset',
+                        default=0,
+                        type=int,
+                        help="Adjusts music start time by [offset] ms.")
+
+    parser.add_argument('-j', '--judge',
+                        default=3,
+                        type=int,
+                        help="Judge difficulty. Defaults to EASY. "
+                        "(3: EASY), (2: NORMAL), (1: HARD), (0: VERY HARD)")
+
+    parser.add_argument('-fmt', '--format',
+                        default='bms',
+                        choices=['bms', 'bmson'],
+                        help="Output format. bmson places notes on exact pulses instead of the BMS grid.")
+
+    parser.add_argument('-res', '--resolution',
+                        default=960,
+                        type=int,
+                        help="Pulses per beat of bmson output. Defaults to 960.")
+
+    parser.add_argument('-sp', '--split',
+                        action='store_true',
+                        default=False,
+                        help="Splits charts longer than 999 measures into several parts instead of failing.")
+
+    parser.add_argument('-w', '--workers',
+                        default=None,
+                        type=int,
+                        help="Worker: conversion processes per job. Defaults to the number of CPUs.")
+
+    parser.add_argument('-tb', '--time_budget',
+                        default=None,
+                        type=float,
+                        help="Worker: seconds a difficulty may take to convert. Its worker process is killed "
+                             "after that and the difficulty is recorded as failed. No limit by default.")
+
+    parser.add_argument('-l', '--lease',
+                        default=60,
+                        type=float,
+                        help="Seconds without a heartbeat after which a job is given to another worker. "
+                             "Defaults to 60.")
+
+    parser.add_argument('-a', '--attempts',
+                        default=3,
+                        type=int,
+                        help="Attempts per job before it is moved to failed. Defaults to 3.")
+
+    parser.add_argument('-jl', '--jsonl',
+                        action='store',
+                        default='None',
+                        help='Coordinator: appends a JSON record per difficulty to this JSON Lines file.',
+                        type=str)
+
+    args = parser.parse_args()
+    if args.submit == "None" and not args.work:
+        parser.error("one of -s and -wk is required")
+
+    job_queue = JobQueue(args.queue, args.lease, args.attempts)
+
+    if args.work:
+        count = run_worker(job_queue, args.workers, time_budget=args.time_budget)
+        print("Converted %d sets" % count)
+        exit(0)
+
+    if args.out_dir == "None":
+        parser.error("-s needs -od")
+    options = {
+        "HITSOUND": args.hitsound,
+        "BG": args.bg,
+        "OFFSET": args.offset,
+        "JUDGE": args.judge,
+        "SPLIT": args.split,
+        "RESOLUTION": args.resolution,
+        "IMAGES": args.images
+    }
+    osz_paths = sorted(os.path.join(args.submit, f) for f in os.listdir(args.submit) if f.endswith(".osz"))
+    # jobs are claimed in the order they are submitted, largest sets first
+    osz_paths.sort(key=estimate_set_cost, reverse=True)
+    job_ids = [job_queue.submit(osz_path, args.out_dir, options, args.format) for osz_path in osz_paths]
+    print("Submitted %d sets" % len(osz_paths))
+
+    while not job_queue.is_finished():
+        reaped = job_queue.reap()
+        if reaped > 0:
+            print("Retrying %d jobs with an expired lease" % reaped)
+        time.sleep(min(5, args.lease / 3))
+
+    results = job_queue.results(job_ids)
+    records = [record for job in results for record in job.get("records", [])]
+    failed_jobs = [job for job in results if "records" not in job]
+    for job in failed_jobs:
+        print("Failed: " + job["osz"] + ": " + "; ".join(job["errors"]))
+    if args.jsonl != "None":
+        write_report(args.jsonl, records)
+    print("Done: %d sets, %d difficulties, %d sets failed" % (len(results), len(records), len(failed_jobs)))
+    exit(0)
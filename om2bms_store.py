@@ -0,0 +1,48 @@
+from argparse import ArgumentParser
+
+from om2bms.asset_store import AssetStore
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description='Maintain the asset store shared by converted sets (om2bms_osz.py -as)',
+                            add_help=True,
+                            allow_abbrev=True)
+
+    parser.add_argument('-st', '--store',
+                        action='store',
+                        default='asset_store',
+                        help='Path to the asset store. Defaults to asset_store',
+                        type=str)
+
+    parser.add_argument('-rm', '--remove',
+                        action='store',
+                        nargs='+',
+                        default=[],
+                        help='Converted set directories to delete. Assets no other set uses are removed from '
+                             'the store.')
+
+    parser.add_argument('-gc', '--gc',
+                        action='store_true',
+                        default=False,
+                        help='Removes assets no set uses anymore, e.g. after set directories were deleted by hand.')
+
+    args = parser.parse_args()
+
+    store = AssetStore(args.store)
+    removed = 0
+    freed = 0
+    for directory in args.remove:
+        (n, size) = store.remove_set(directory)
+        removed += n
+        freed += size
+        print("Removed " + directory)
+    if args.gc:
+        (n, size) = store.gc()
+        removed += n
+        freed += size
+    if args.gc or len(args.remove) > 0:
+        print("Collected %d assets, %.1f MB" % (removed, freed / 1e6))
+    count, size, links = store.stats()
+    print("%d assets, %.1f MB, linked %d times" % (count, size / 1e6, links))
+    exit(0)